@@ -5,9 +5,24 @@ import time
 import json
 from datetime import datetime
 import sqlite3
+import gzip
+import tempfile
 import hashlib
-from typing import List, Dict, Optional, Tuple
+import os
+import queue
+import random
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, List, Dict, Optional, Tuple
 import uuid
+import zlib
+import numpy as np
+from requests.adapters import HTTPAdapter
 
 # Set up the Streamlit app
 st.set_page_config(page_title="CineAI - AI Movie Production Agent", page_icon="🎬", layout="wide")
@@ -101,9 +116,178 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Instrumentation. A process-wide registry of counters and latency
+# histograms, filled in by timed()/instrumented() around upstream calls, DB
+# queries, caches and reruns. It is exported in Prometheus text format on
+# CINEAI_METRICS_PORT (if set) and/or dumped as JSON to
+# CINEAI_METRICS_JSON_PATH every CINEAI_METRICS_DUMP_INTERVAL seconds. The
+# port only listens on localhost unless CINEAI_METRICS_HOST says otherwise,
+# since the metrics include per-user timings and error counts.
+METRICS_PORT = os.environ.get("CINEAI_METRICS_PORT")
+METRICS_HOST = os.environ.get("CINEAI_METRICS_HOST", "127.0.0.1")
+METRICS_JSON_PATH = os.environ.get("CINEAI_METRICS_JSON_PATH")
+METRICS_DUMP_INTERVAL = float(os.environ.get("CINEAI_METRICS_DUMP_INTERVAL", 60))
+ADMIN_USERS = {name.strip() for name in os.environ.get("CINEAI_ADMIN_USERS", "").split(",") if name.strip()}
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # [per-bucket counts..., +Inf count, sum]
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(self.buckets)] += 1
+            histogram[-1] += value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self._counters.items()]
+            histograms = []
+            for (name, labels), histogram in self._histograms.items():
+                counts = histogram[:-1]
+                histograms.append({
+                    'name': name, 'labels': dict(labels),
+                    'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], counts)),
+                    'count': sum(counts), 'sum': histogram[-1]
+                })
+        return {'timestamp': time.time(), 'pid': os.getpid(), 'counters': counters, 'histograms': histograms}
+
+    def render_prometheus(self) -> str:
+        def fmt_labels(labels: Dict, extra: Optional[Tuple[str, str]] = None) -> str:
+            items = list(labels.items()) + ([extra] if extra else [])
+            if not items:
+                return ''
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+            return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in sorted(snapshot['counters'], key=lambda c: c['name']):
+            if counter['name'] not in typed:
+                lines.append(f"# TYPE {counter['name']} counter")
+                typed.add(counter['name'])
+            lines.append(f"{counter['name']}{fmt_labels(counter['labels'])} {counter['value']}")
+        for histogram in sorted(snapshot['histograms'], key=lambda h: h['name']):
+            name = histogram['name']
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in histogram['buckets'].items():
+                cumulative += count
+                lines.append(f"{name}_bucket{fmt_labels(histogram['labels'], ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{fmt_labels(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{fmt_labels(histogram['labels'])} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+
+def _start_metrics_server(registry: MetricsRegistry, host: str, port: int):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] == '/metrics':
+                body = registry.render_prometheus().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path.split('?')[0] == '/metrics.json':
+                body = json.dumps(registry.snapshot()).encode('utf-8')
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+def _dump_metrics_periodically(registry: MetricsRegistry, path: str, interval: float):
+    path = path.replace('{pid}', str(os.getpid()))
+    while True:
+        time.sleep(interval)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(tmp_path, path)
+
+@st.cache_resource
+def get_metrics() -> MetricsRegistry:
+    registry = MetricsRegistry()
+    if METRICS_PORT:
+        try:
+            _start_metrics_server(registry, METRICS_HOST, int(METRICS_PORT))
+        except OSError:
+            # Another app process already serves this port
+            pass
+    if METRICS_JSON_PATH:
+        threading.Thread(target=_dump_metrics_periodically, name="metrics-dump", daemon=True,
+                         args=(registry, METRICS_JSON_PATH, METRICS_DUMP_INTERVAL)).start()
+    return registry
+
+# Spans recorded on the script thread during the current rerun, for the
+# admin timing panel
+_rerun_spans = threading.local()
+
+@contextmanager
+def timed(name: str, **labels):
+    """Record the duration of the block in the ``{name}_seconds`` histogram and
+    count exceptions in ``{name}_errors_total`` by class."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        get_metrics().inc(f"{name}_errors_total", error=type(e).__name__, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        get_metrics().observe(f"{name}_seconds", elapsed, **labels)
+        spans = getattr(_rerun_spans, 'spans', None)
+        if spans is not None:
+            spans.append((name, labels, elapsed))
+
+def instrumented(name: str, **labels):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_cache_lookup(cache: str, result: str):
+    get_metrics().inc("cineai_cache_lookups_total", cache=cache, result=result)
+
 # Database setup
-def init_db():
-    conn = sqlite3.connect('movie_agent.db')
+DB_PATH = os.environ.get("CINEAI_DB_PATH", 'movie_agent.db')
+DB_POOL_SIZE = int(os.environ.get("CINEAI_DB_POOL_SIZE", 8))
+DB_BUSY_TIMEOUT = float(os.environ.get("CINEAI_DB_BUSY_TIMEOUT", 10))
+DB_STATEMENT_CACHE_SIZE = 256
+
+def init_db(conn: sqlite3.Connection):
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -126,254 +310,3267 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_movie_concepts_user_created
+        ON movie_concepts (user_id, created_at DESC, id DESC)
+    ''')
+    ensure_column(conn, 'movie_concepts', 'storage_version', 'INTEGER NOT NULL DEFAULT 1')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS concept_sections (
+            concept_id INTEGER NOT NULL,
+            section TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (concept_id, section),
+            FOREIGN KEY (concept_id) REFERENCES movie_concepts (id)
+        )
+    ''')
+    # Structured casting and production fields (see STRUCTURED_OUTPUT)
+    ensure_column(conn, 'movie_concepts', 'genre', 'TEXT')
+    # Regenerated versions point at the concept they were derived from
+    ensure_column(conn, 'movie_concepts', 'parent_id', 'INTEGER')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_movie_concepts_parent ON movie_concepts (parent_id)')
+    # Bumped on every change to a user's concepts. Memoized concept lists are
+    # keyed on it, so a save in one app process is seen by all the others
+    ensure_column(conn, 'users', 'concepts_version', 'INTEGER NOT NULL DEFAULT 0')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_concepts_version_insert AFTER INSERT ON movie_concepts BEGIN
+            UPDATE users SET concepts_version = concepts_version + 1 WHERE id = NEW.user_id;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_concepts_version_update AFTER UPDATE ON movie_concepts BEGIN
+            UPDATE users SET concepts_version = concepts_version + 1 WHERE id IN (OLD.user_id, NEW.user_id);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS user_concepts_version_delete AFTER DELETE ON movie_concepts BEGIN
+            UPDATE users SET concepts_version = concepts_version + 1 WHERE id = OLD.user_id;
+        END
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS concept_cast (
+            concept_id INTEGER NOT NULL,
+            character_rank INTEGER NOT NULL,
+            character TEXT NOT NULL,
+            actor_rank INTEGER NOT NULL,
+            actor TEXT NOT NULL,
+            PRIMARY KEY (concept_id, character_rank, actor_rank),
+            FOREIGN KEY (concept_id) REFERENCES movie_concepts (id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_concept_cast_actor ON concept_cast (actor)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS concept_production (
+            concept_id INTEGER PRIMARY KEY,
+            budget_min_musd REAL,
+            budget_max_musd REAL,
+            FOREIGN KEY (concept_id) REFERENCES movie_concepts (id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS concept_production_picks (
+            concept_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (concept_id, kind, rank),
+            FOREIGN KEY (concept_id) REFERENCES movie_concepts (id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_concept_production_picks_name ON concept_production_picks (kind, name)')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS concept_structured_delete AFTER DELETE ON movie_concepts BEGIN
+            DELETE FROM concept_cast WHERE concept_id = OLD.id;
+            DELETE FROM concept_production WHERE concept_id = OLD.id;
+            DELETE FROM concept_production_picks WHERE concept_id = OLD.id;
+        END
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS actor_cache (
+            actor_key TEXT NOT NULL,
+            industry TEXT NOT NULL,
+            actor_info TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            PRIMARY KEY (actor_key, industry)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            cache_key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            params TEXT NOT NULL,
+            progress TEXT,
+            worker_id TEXT,
+            concept_id INTEGER,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_status
+        ON generation_jobs (status, created_at)
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_user
+        ON generation_jobs (user_id, created_at DESC)
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS industry_trends (
+            industry TEXT PRIMARY KEY,
+            trends TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS upstream_leases (
+            lease_key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.commit()
+    migrate_concept_storage(conn)
+    init_concept_search(conn)
+    init_concept_embeddings(conn)
+
+def ensure_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# Concept storage. storage_version 1 rows keep the whole concept as one JSON
+# blob in concept_data; version 2 rows keep each long section compressed in
+# its own concept_sections row and only small metadata in concept_data.
+CONCEPT_STORAGE_VERSION = 2
+CONCEPT_SECTIONS = ('script', 'casting', 'production')
+# Kept in their own tables rather than in concept_data
+CONCEPT_STRUCTURED_FIELDS = ('cast', 'production_details')
+SECTION_FORMAT_RAW = 0
+SECTION_FORMAT_ZLIB = 1
+
+def pack_section(text: str) -> bytes:
+    return bytes([SECTION_FORMAT_ZLIB]) + zlib.compress(text.encode('utf-8'), 6)
+
+def unpack_section(data: bytes) -> str:
+    fmt, payload = data[0], bytes(data[1:])
+    if fmt == SECTION_FORMAT_ZLIB:
+        return zlib.decompress(payload).decode('utf-8')
+    if fmt == SECTION_FORMAT_RAW:
+        return payload.decode('utf-8')
+    raise ValueError(f"Unknown concept section format {fmt}")
+
+def split_concept_data(concept_data: Dict) -> Tuple[Dict, List[Tuple[str, bytes]]]:
+    metadata = {k: v for k, v in concept_data.items()
+                if k not in CONCEPT_SECTIONS and k not in CONCEPT_STRUCTURED_FIELDS}
+    sections = [(section, pack_section(concept_data[section]))
+                for section in CONCEPT_SECTIONS if concept_data.get(section) is not None]
+    return metadata, sections
+
+def migrate_concept_storage(conn: sqlite3.Connection, batch_size: int = 200):
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, concept_data FROM movie_concepts WHERE storage_version < ? AND id > ? "
+            "ORDER BY id LIMIT ?",
+            (CONCEPT_STORAGE_VERSION, last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+
+        for concept_id, raw in rows:
+            metadata, sections = split_concept_data(json.loads(raw) if raw else {})
+            conn.executemany(
+                "INSERT OR REPLACE INTO concept_sections (concept_id, section, data) VALUES (?, ?, ?)",
+                [(concept_id, section, data) for section, data in sections]
+            )
+            conn.execute(
+                "UPDATE movie_concepts SET concept_data = ?, storage_version = ? WHERE id = ?",
+                (json.dumps(metadata), CONCEPT_STORAGE_VERSION, concept_id)
+            )
+        conn.commit()
+        last_id = rows[-1][0]
+
+# Full-text search over saved concepts. concept_search is an external-content
+# FTS5 index over the concept_search_docs view: it stores only the index, and
+# snippet() reads the text back through the view, which decompresses sections
+# with the concept_text() SQL function (registered on every pooled
+# connection) for the matched rows only. External-content rows can only be
+# removed by replaying their indexed text, so the triggers drop a concept's
+# row BEFORE each change (while the view still shows the indexed text) and
+# re-add it AFTER.
+def register_db_functions(conn: sqlite3.Connection):
+    conn.create_function(
+        'concept_text', 1,
+        lambda data: unpack_section(data) if data is not None else None,
+        deterministic=True
+    )
+
+_CONCEPT_SEARCH_TRIGGERS = (
+    'concept_search_insert', 'concept_search_update', 'concept_search_delete',
+    'concept_search_section_insert', 'concept_search_section_update', 'concept_search_section_delete',
+    'concept_search_before_update', 'concept_search_before_delete',
+    'concept_search_section_before_insert', 'concept_search_section_before_update',
+    'concept_search_section_before_delete',
+)
+
+def init_concept_search(conn: sqlite3.Connection):
+    existing = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'concept_search'"
+    ).fetchone()
+    c = conn.cursor()
+    if existing and 'concept_search_docs' not in existing[0]:
+        # Earlier databases kept a full uncompressed copy of every section in
+        # the index; rebuild it as external-content
+        for trigger in _CONCEPT_SEARCH_TRIGGERS:
+            c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        c.execute("DROP TABLE concept_search")
+        existing = None
+    c.executescript('''
+        CREATE VIEW IF NOT EXISTS concept_search_docs AS
+        SELECT m.id, m.title,
+            (SELECT concept_text(data) FROM concept_sections WHERE concept_id = m.id AND section = 'script') AS script,
+            (SELECT concept_text(data) FROM concept_sections WHERE concept_id = m.id AND section = 'casting') AS casting,
+            (SELECT concept_text(data) FROM concept_sections WHERE concept_id = m.id AND section = 'production') AS production
+        FROM movie_concepts m;
+        CREATE VIRTUAL TABLE IF NOT EXISTS concept_search USING fts5(
+            title, script, casting, production,
+            content = 'concept_search_docs', content_rowid = 'id',
+            tokenize = 'porter unicode61'
+        );
+    ''')
+    drop_row = '''
+            INSERT INTO concept_search (concept_search, rowid, title, script, casting, production)
+            SELECT 'delete', id, title, script, casting, production FROM concept_search_docs WHERE id = {id};
+    '''
+    add_row = '''
+            INSERT INTO concept_search (rowid, title, script, casting, production)
+            SELECT id, title, script, casting, production FROM concept_search_docs WHERE id = {id};
+    '''
+    sections = "WHEN {row}.section IN ('script', 'casting', 'production')"
+    c.executescript(f'''
+        CREATE TRIGGER IF NOT EXISTS concept_search_insert AFTER INSERT ON movie_concepts BEGIN
+            {add_row.format(id='NEW.id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_before_update BEFORE UPDATE OF title ON movie_concepts BEGIN
+            {drop_row.format(id='OLD.id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_update AFTER UPDATE OF title ON movie_concepts BEGIN
+            {add_row.format(id='NEW.id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_before_delete BEFORE DELETE ON movie_concepts BEGIN
+            {drop_row.format(id='OLD.id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_section_before_insert BEFORE INSERT ON concept_sections
+        {sections.format(row='NEW')} BEGIN
+            {drop_row.format(id='NEW.concept_id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_section_insert AFTER INSERT ON concept_sections
+        {sections.format(row='NEW')} BEGIN
+            {add_row.format(id='NEW.concept_id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_section_before_update BEFORE UPDATE OF data ON concept_sections
+        {sections.format(row='NEW')} BEGIN
+            {drop_row.format(id='NEW.concept_id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_section_update AFTER UPDATE OF data ON concept_sections
+        {sections.format(row='NEW')} BEGIN
+            {add_row.format(id='NEW.concept_id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_section_before_delete BEFORE DELETE ON concept_sections
+        {sections.format(row='OLD')} BEGIN
+            {drop_row.format(id='OLD.concept_id')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS concept_search_section_delete AFTER DELETE ON concept_sections
+        {sections.format(row='OLD')} BEGIN
+            {add_row.format(id='OLD.concept_id')}
+        END;
+    ''')
+    if not existing:
+        # Index everything saved before search existed
+        c.execute('''
+            INSERT INTO concept_search (rowid, title, script, casting, production)
+            SELECT id, title, script, casting, production FROM concept_search_docs
+        ''')
     conn.commit()
-    conn.close()
 
-init_db()
+# Similarity index. Each concept gets a hashed n-gram embedding (word
+# unigrams and bigrams, signed feature hashing, sublinear tf, L2-normalised)
+# stored in concept_embeddings when it is saved. SimilarityIndex keeps one
+# float32 matrix per user in memory and tops it up with newer rows on each
+# query, so top-k cosine similarity is a single matrix-vector product.
+EMBEDDING_DIM = 1024
+EMBEDDING_VERSION = 1
+# Script outlines open with the title, logline and synopsis: the premise
+EMBEDDING_TEXT_CHARS = 2000
+SIMILAR_CONCEPTS_K = 3
+SIMILARITY_THRESHOLD = float(os.environ.get("CINEAI_SIMILARITY_THRESHOLD", 0.2))
+# Below this, "similar" concepts only share stray words
+SIMILAR_MIN_SCORE = 0.05
+# Users whose embedding matrices stay in memory (least recently used evicted)
+SIMILARITY_INDEX_MAX_USERS = int(os.environ.get("CINEAI_SIMILARITY_INDEX_MAX_USERS", 256))
+
+_EMBED_TOKEN_RE = re.compile(r"[^\W_]+")
+_EMBED_STOPWORDS = frozenset("""
+    a an the and or but of for with as in on at by to from into is are was were be been being it its
+    this that these those he she they his her their them who whom which what when where while
+    has have had not no so than then there very can will would should could about after before
+    over under up down out all any each more most other some such only own same too just also
+    movie film story character characters scene scenes act script plot
+""".split())
+
+def _embed_token(token: str) -> str:
+    # Crude plural folding, enough to match "chefs" with "chef"
+    return token[:-1] if len(token) > 3 and token.endswith('s') and not token.endswith('ss') else token
+
+def embed_text(text: str) -> np.ndarray:
+    tokens = [_embed_token(token) for token in _EMBED_TOKEN_RE.findall(text[:EMBEDDING_TEXT_CHARS].casefold())
+              if len(token) > 1 and token not in _EMBED_STOPWORDS]
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    if not features:
+        return vector
+    hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features),
+                         dtype=np.uint32, count=len(features))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+    counts = np.bincount(hashes % EMBEDDING_DIM, weights=signs, minlength=EMBEDDING_DIM)
+    vector[:] = np.sign(counts) * np.log1p(np.abs(counts))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def concept_embedding(title: str, script: Optional[str]) -> np.ndarray:
+    return embed_text(f"{title}\n{script or ''}")
+
+def init_concept_embeddings(conn: sqlite3.Connection, batch_size: int = 200):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS concept_embeddings (
+            concept_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            embedding BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_concept_embeddings_user ON concept_embeddings (user_id, concept_id);
+        CREATE TRIGGER IF NOT EXISTS concept_embeddings_delete AFTER DELETE ON movie_concepts BEGIN
+            DELETE FROM concept_embeddings WHERE concept_id = OLD.id;
+        END;
+    ''')
+    # Embed concepts saved before the index existed (or under an older version)
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT m.id, m.user_id, m.title, s.data FROM movie_concepts m
+            LEFT JOIN concept_sections s ON s.concept_id = m.id AND s.section = 'script'
+            LEFT JOIN concept_embeddings e ON e.concept_id = m.id
+            WHERE m.id > ? AND (e.concept_id IS NULL OR e.version != ?)
+            ORDER BY m.id LIMIT ?
+        ''', (last_id, EMBEDDING_VERSION, batch_size)).fetchall()
+        if not rows:
+            return
+        conn.executemany(
+            "INSERT OR REPLACE INTO concept_embeddings (concept_id, user_id, version, embedding) VALUES (?, ?, ?, ?)",
+            [(concept_id, user_id, EMBEDDING_VERSION,
+              concept_embedding(title, unpack_section(data) if data else None).tobytes())
+             for concept_id, user_id, title, data in rows]
+        )
+        conn.commit()
+        last_id = rows[-1][0]
+
+class ConnectionPool:
+    """A small pool of long-lived SQLite connections shared by every session.
+
+    Connections run in WAL mode with a busy timeout, so readers never block
+    the writer and concurrent writers wait instead of failing with "database
+    is locked". Keeping them open also keeps each connection's prepared
+    statement cache warm.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, size: int = DB_POOL_SIZE,
+                 busy_timeout: float = DB_BUSY_TIMEOUT):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        register_db_functions(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success and rolls back on error."""
+        wait_start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.busy_timeout):
+            get_metrics().inc("cineai_db_pool_timeouts_total")
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+        get_metrics().observe("cineai_db_pool_wait_seconds", time.perf_counter() - wait_start)
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+@st.cache_resource
+def get_db() -> ConnectionPool:
+    pool = ConnectionPool()
+    # Schema setup runs once per process rather than on every script run
+    with pool.connection() as conn:
+        init_db(conn)
+    return pool
+
+def db_connection():
+    return get_db().connection()
+
+
+# Memoization of derived data, so a Streamlit rerun with unchanged inputs
+# does no DB or parsing work. MemoCache is process-wide (shared by every
+# session, bounded LRU, optional TTL as a backstop for writes made by other
+# processes) and writers invalidate the keys they touch. session_memo keeps
+# the latest value per name in the session itself.
+MEMO_MAX_ENTRIES = int(os.environ.get("CINEAI_MEMO_MAX_ENTRIES", 2048))
+MEMO_TTL = float(os.environ.get("CINEAI_MEMO_TTL", 300))
+
+class MemoCache:
+    def __init__(self, name: str, max_entries: int = MEMO_MAX_ENTRIES, ttl: Optional[float] = MEMO_TTL):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (self.ttl is None or now - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                record_cache_lookup(f"memo_{self.name}", 'hit')
+                return entry[0]
+
+        record_cache_lookup(f"memo_{self.name}", 'miss')
+        value = compute()
+        with self._lock:
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+@st.cache_resource
+def get_memo(name: str) -> MemoCache:
+    return MemoCache(name)
+
+def session_memo(name: str, key, compute):
+    memo = st.session_state.setdefault('_memo', {})
+    entry = memo.get(name)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+    value = compute()
+    memo[name] = (key, value)
+    return value
+
+# A user's concept lists are keyed on users.concepts_version, which the
+# movie_concepts triggers bump whichever process writes. Local writers still
+# drop the stale entries right away rather than leaving them to the LRU.
+@instrumented('cineai_db_query', query='get_concepts_version')
+def get_concepts_version(user_id) -> int:
+    with db_connection() as conn:
+        row = conn.execute("SELECT concepts_version FROM users WHERE id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+def user_concepts_memo(user_id, key: Tuple, compute):
+    return get_memo('user_concepts').get_or_compute((user_id, get_concepts_version(user_id)) + key, compute)
+
+def invalidate_user_concepts(user_id):
+    get_memo('user_concepts').invalidate_where(lambda key: key[0] == user_id)
 
 # Password hashing
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 # User authentication functions
+@instrumented('cineai_db_query', query='create_user')
 def create_user(username, password):
-    conn = sqlite3.connect('movie_agent.db')
-    c = conn.cursor()
-    try:
-        c.execute(
-            "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-            (username, hash_password(password))
-        )
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
+    with db_connection() as conn:
+        try:
+            conn.execute(
+                "INSERT INTO users (username, password_hash) VALUES (?, ?)",
+                (username, hash_password(password))
+            )
+            return True
+        except sqlite3.IntegrityError:
+            return False
 
+@instrumented('cineai_db_query', query='authenticate_user')
 def authenticate_user(username, password):
-    conn = sqlite3.connect('movie_agent.db')
-    c = conn.cursor()
-    c.execute(
-        "SELECT id, password_hash FROM users WHERE username = ?",
-        (username,)
-    )
-    user = c.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        user = conn.execute(
+            "SELECT id, password_hash FROM users WHERE username = ?",
+            (username,)
+        ).fetchone()
     
     if user and user[1] == hash_password(password):
         return user[0]
     return None
 
-def get_user_api_keys(user_id):
-    conn = sqlite3.connect('movie_agent.db')
-    c = conn.cursor()
-    c.execute(
-        "SELECT gemini_api_key, serp_api_key FROM users WHERE id = ?",
-        (user_id,)
-    )
-    keys = c.fetchone()
-    conn.close()
-    return keys or (None, None)
+def get_user_api_keys(user_id):
+    return get_memo('api_keys').get_or_compute(user_id, lambda: load_user_api_keys(user_id))
+
+# Uncached, for callers that may run in a different process from the one
+# where the keys were last saved (the job dispatcher)
+@instrumented('cineai_db_query', query='get_user_api_keys')
+def load_user_api_keys(user_id):
+    with db_connection() as conn:
+        keys = conn.execute(
+            "SELECT gemini_api_key, serp_api_key FROM users WHERE id = ?",
+            (user_id,)
+        ).fetchone()
+    return keys or (None, None)
+
+@instrumented('cineai_db_query', query='save_user_api_keys')
+def save_user_api_keys(user_id, gemini_key, serp_key):
+    with db_connection() as conn:
+        conn.execute(
+            "UPDATE users SET gemini_api_key = ?, serp_api_key = ? WHERE id = ?",
+            (gemini_key, serp_key, user_id)
+        )
+    get_memo('api_keys').invalidate(user_id)
+
+def concept_structured_rows(concept_id: int, concept_data: Dict) -> Tuple[List[Tuple], List[Tuple], List[Tuple]]:
+    """concept_cast, concept_production and concept_production_picks rows for a concept."""
+    cast_rows = []
+    for character_rank, role in enumerate(_dicts(concept_data.get('cast'))):
+        actors = role.get('actors') if isinstance(role.get('actors'), list) else []
+        cast_rows.extend((concept_id, character_rank, _text(role.get('character')), actor_rank, _text(actor))
+                         for actor_rank, actor in enumerate(actors) if _text(actor))
+    production_rows, pick_rows = [], []
+    details = concept_data.get('production_details')
+    if isinstance(details, dict):
+        production_rows.append((concept_id, _number(details.get('budget_min_musd')),
+                                _number(details.get('budget_max_musd'))))
+        for kind in ('location', 'director'):
+            names = details.get(kind + 's') if isinstance(details.get(kind + 's'), list) else []
+            pick_rows.extend((concept_id, kind, rank, _text(name)) for rank, name in enumerate(names))
+    return cast_rows, production_rows, pick_rows
+
+def write_concept_structured(conn, cast_rows: List[Tuple], production_rows: List[Tuple], pick_rows: List[Tuple]):
+    conn.executemany(
+        "INSERT INTO concept_cast (concept_id, character_rank, character, actor_rank, actor) VALUES (?, ?, ?, ?, ?)",
+        cast_rows
+    )
+    conn.executemany(
+        "INSERT INTO concept_production (concept_id, budget_min_musd, budget_max_musd) VALUES (?, ?, ?)",
+        production_rows
+    )
+    conn.executemany(
+        "INSERT INTO concept_production_picks (concept_id, kind, rank, name) VALUES (?, ?, ?, ?)",
+        pick_rows
+    )
+
+def load_concept_structured(conn, concept_ids: List[int]) -> Dict[int, Dict]:
+    """'cast' and 'production_details' of the given concepts, for those that have them."""
+    structured: Dict[int, Dict] = {}
+    placeholders = ','.join('?' * len(concept_ids))
+    for concept_id, character_rank, character, actor in conn.execute(
+        f"SELECT concept_id, character_rank, character, actor FROM concept_cast "
+        f"WHERE concept_id IN ({placeholders}) ORDER BY concept_id, character_rank, actor_rank", concept_ids
+    ):
+        cast = structured.setdefault(concept_id, {}).setdefault('cast', {})
+        cast.setdefault(character_rank, {'character': character, 'actors': []})['actors'].append(actor)
+    for fields in structured.values():
+        fields['cast'] = list(fields['cast'].values())
+    for concept_id, budget_min, budget_max in conn.execute(
+        f"SELECT concept_id, budget_min_musd, budget_max_musd FROM concept_production "
+        f"WHERE concept_id IN ({placeholders})", concept_ids
+    ):
+        structured.setdefault(concept_id, {})['production_details'] = {
+            'budget_min_musd': budget_min, 'budget_max_musd': budget_max, 'locations': [], 'directors': []
+        }
+    for concept_id, kind, name in conn.execute(
+        f"SELECT concept_id, kind, name FROM concept_production_picks "
+        f"WHERE concept_id IN ({placeholders}) ORDER BY concept_id, kind, rank", concept_ids
+    ):
+        structured[concept_id]['production_details'][kind + 's'].append(name)
+    return structured
+
+def _insert_concept(conn, user_id, title, industry, concept_data, parent_id=None) -> int:
+    metadata, sections = split_concept_data(concept_data)
+    c = conn.execute(
+        "INSERT INTO movie_concepts (user_id, title, industry, genre, concept_data, storage_version, parent_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (user_id, title, industry, _text(concept_data.get('genre')) or None, json.dumps(metadata),
+         CONCEPT_STORAGE_VERSION, parent_id)
+    )
+    concept_id = c.lastrowid
+    conn.executemany(
+        "INSERT INTO concept_sections (concept_id, section, data) VALUES (?, ?, ?)",
+        [(concept_id, section, data) for section, data in sections]
+    )
+    conn.execute(
+        "INSERT INTO concept_embeddings (concept_id, user_id, version, embedding) VALUES (?, ?, ?, ?)",
+        (concept_id, user_id, EMBEDDING_VERSION, concept_embedding(title, concept_data.get('script')).tobytes())
+    )
+    write_concept_structured(conn, *concept_structured_rows(concept_id, concept_data))
+    return concept_id
+
+@instrumented('cineai_db_query', query='save_movie_concept')
+def save_movie_concept(user_id, title, industry, concept_data, parent_id=None):
+    with db_connection() as conn:
+        concept_id = _insert_concept(conn, user_id, title, industry, concept_data, parent_id)
+    invalidate_user_concepts(user_id)
+    return concept_id
+
+# Regenerated versions are numbered across the whole lineage (every concept
+# reachable through parent_id from the original), so regenerating the same
+# concept twice gives v2 and v3 rather than two v2s.
+def next_concept_version(conn, parent_id) -> int:
+    latest = conn.execute('''
+        WITH RECURSIVE ancestors (id, parent_id) AS (
+            SELECT id, parent_id FROM movie_concepts WHERE id = ?
+            UNION
+            SELECT m.id, m.parent_id FROM movie_concepts m JOIN ancestors a ON m.id = a.parent_id
+        ),
+        lineage (id) AS (
+            SELECT id FROM ancestors WHERE parent_id IS NULL OR parent_id NOT IN (SELECT id FROM ancestors)
+            UNION
+            SELECT m.id FROM movie_concepts m JOIN lineage l ON m.parent_id = l.id
+        )
+        SELECT MAX(COALESCE(json_extract(m.concept_data, '$.version'), 1))
+        FROM movie_concepts m JOIN lineage USING (id)
+    ''', (parent_id,)).fetchone()[0]
+    return (latest or 1) + 1
+
+@instrumented('cineai_db_query', query='save_concept_version')
+def save_concept_version(user_id, title, industry, concept_data, parent_id) -> Tuple[int, str]:
+    """Save a regenerated concept as the next version of parent_id; returns (id, versioned title)."""
+    with db_connection() as conn:
+        # Take the write lock up front, so concurrent regenerations can't claim the same number
+        conn.execute("BEGIN IMMEDIATE")
+        concept_data['version'] = next_concept_version(conn, parent_id)
+        title = versioned_title(title, concept_data['version'])
+        concept_id = _insert_concept(conn, user_id, title, industry, concept_data, parent_id)
+    invalidate_user_concepts(user_id)
+    return concept_id, title
+
+@instrumented('cineai_db_query', query='save_movie_concepts')
+def save_movie_concepts(user_id, concepts: List[Tuple[str, str, Dict]]) -> List[int]:
+    """Save several (title, industry, concept_data) concepts in one transaction."""
+    with db_connection() as conn:
+        concept_ids = [_insert_concept(conn, user_id, title, industry, concept_data)
+                       for title, industry, concept_data in concepts]
+    invalidate_user_concepts(user_id)
+    return concept_ids
+
+# Keyset pagination over a user's concepts, newest first. The cursor is the
+# (created_at, id) of the last row of the previous page, so each page is a
+# range scan on idx_movie_concepts_user_created no matter how deep it is.
+def get_user_concepts_page(user_id, page_size: int, cursor: Optional[Tuple[str, int]] = None):
+    return user_concepts_memo(
+        user_id, ('page', page_size, cursor),
+        lambda: _load_user_concepts_page(user_id, page_size, cursor)
+    )
+
+@instrumented('cineai_db_query', query='load_user_concepts_page')
+def _load_user_concepts_page(user_id, page_size: int, cursor: Optional[Tuple[str, int]]):
+    with db_connection() as conn:
+        if cursor is None:
+            rows = conn.execute(
+                "SELECT id, title, industry, created_at FROM movie_concepts WHERE user_id = ? "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (user_id, page_size + 1)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, title, industry, created_at FROM movie_concepts "
+                "WHERE user_id = ? AND (created_at, id) < (?, ?) "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (user_id, cursor[0], cursor[1], page_size + 1)
+            ).fetchall()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1][3], rows[-1][0])
+    return rows, next_cursor
+
+# Saved concepts are never edited in place, so details can be memoized by id
+def get_concept_details(concept_id):
+    concept_data = get_memo('concept_details').get_or_compute(
+        concept_id, lambda: _load_concept_details(concept_id)
+    )
+    return dict(concept_data) if concept_data else None
+
+def get_concept_owner(concept_id) -> Optional[int]:
+    with db_connection() as conn:
+        row = conn.execute("SELECT user_id FROM movie_concepts WHERE id = ?", (concept_id,)).fetchone()
+    return row[0] if row else None
+
+@instrumented('cineai_db_query', query='load_concept_details')
+def _load_concept_details(concept_id):
+    with db_connection() as conn:
+        concept = conn.execute(
+            "SELECT concept_data, storage_version FROM movie_concepts WHERE id = ?",
+            (concept_id,)
+        ).fetchone()
+        if not concept:
+            return None
+        concept_data = json.loads(concept[0]) if concept[0] else {}
+        if concept[1] < CONCEPT_STORAGE_VERSION:
+            return concept_data
+        sections = conn.execute(
+            "SELECT section, data FROM concept_sections WHERE concept_id = ?",
+            (concept_id,)
+        ).fetchall()
+        concept_data.update(load_concept_structured(conn, [concept_id]).get(concept_id, {}))
+    for section, data in sections:
+        concept_data[section] = unpack_section(data)
+    return concept_data
+
+# Ranked full-text search over a user's concepts. Every word of the query
+# must match (the last one as a prefix); results are ordered by bm25 with
+# title hits weighted highest.
+def build_search_query(text: str) -> Optional[str]:
+    terms = re.findall(r'\w+', text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def search_user_concepts(user_id, text: str, page_size: int, offset: int = 0):
+    query = build_search_query(text)
+    if not query:
+        return [], False
+    return user_concepts_memo(
+        user_id, ('search', query, page_size, offset),
+        lambda: _search_user_concepts(user_id, query, page_size, offset)
+    )
+
+@instrumented('cineai_db_query', query='search_user_concepts')
+def _search_user_concepts(user_id, query: str, page_size: int, offset: int):
+    with db_connection() as conn:
+        rows = conn.execute(
+            '''
+            SELECT m.id, m.title, m.industry, m.created_at,
+                   snippet(concept_search, -1, '**', '**', '…', 16)
+            FROM concept_search
+            JOIN movie_concepts m ON m.id = concept_search.rowid
+            WHERE concept_search MATCH ? AND m.user_id = ?
+            ORDER BY bm25(concept_search, 10.0, 1.0, 2.0, 1.0)
+            LIMIT ? OFFSET ?
+            ''',
+            (query, user_id, page_size + 1, offset)
+        ).fetchall()
+    return rows[:page_size], len(rows) > page_size
+
+# SQL aggregates over the structured production fields. Budgets are in
+# millions of US dollars; concepts without structured production notes (or
+# saved before genres were recorded) are left out.
+def get_budget_by_genre(user_id) -> List[Tuple[str, int, Optional[float], Optional[float]]]:
+    """(genre, concepts, average low estimate, average high estimate) rows."""
+    return user_concepts_memo(
+        user_id, ('budget_by_genre',), lambda: _load_budget_by_genre(user_id)
+    )
+
+@instrumented('cineai_db_query', query='budget_by_genre')
+def _load_budget_by_genre(user_id):
+    with db_connection() as conn:
+        return conn.execute('''
+            SELECT m.genre, COUNT(*), AVG(p.budget_min_musd), AVG(p.budget_max_musd)
+            FROM movie_concepts m JOIN concept_production p ON p.concept_id = m.id
+            WHERE m.user_id = ? AND m.genre IS NOT NULL
+            GROUP BY m.genre ORDER BY m.genre
+        ''', (user_id,)).fetchall()
+
+class SimilarityIndex:
+    def __init__(self, max_users: int = SIMILARITY_INDEX_MAX_USERS):
+        self.max_users = max_users
+        # user_id -> (concept ids, embedding matrix), least recently used first
+        self._users: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        # Only guards the dict; rows are read and stacked outside it
+        self._lock = threading.Lock()
+
+    def _refresh(self, user_id) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                self._users.move_to_end(user_id)
+        ids, matrix = entry or (np.empty(0, dtype=np.int64), np.empty((0, EMBEDDING_DIM), dtype=np.float32))
+        last_id = int(ids[-1]) if len(ids) else 0
+        with db_connection() as conn:
+            rows = conn.execute(
+                "SELECT concept_id, embedding FROM concept_embeddings "
+                "WHERE user_id = ? AND concept_id > ? AND version = ? ORDER BY concept_id",
+                (user_id, last_id, EMBEDDING_VERSION)
+            ).fetchall()
+        if not rows:
+            return ids, matrix
+
+        new_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        new_rows = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32)
+        ids = np.concatenate([ids, new_ids])
+        matrix = np.vstack([matrix, new_rows.reshape(len(rows), EMBEDDING_DIM)])
+        with self._lock:
+            # A concurrent refresh may already have stored a longer matrix
+            current = self._users.get(user_id)
+            if current is None or current[0][-1] < ids[-1]:
+                self._users[user_id] = (ids, matrix)
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        return ids, matrix
+
+    def query(self, user_id, vector: np.ndarray, k: int = SIMILAR_CONCEPTS_K,
+              exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top ``k`` (concept_id, cosine similarity) pairs, best first."""
+        ids, matrix = self._refresh(user_id)
+        if not len(ids):
+            return []
+        scores = matrix @ vector
+        if exclude is not None:
+            scores[ids == exclude] = -1.0
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def vector(self, user_id, concept_id: int) -> Optional[np.ndarray]:
+        ids, matrix = self._refresh(user_id)
+        position = np.searchsorted(ids, concept_id)
+        if position < len(ids) and ids[position] == concept_id:
+            return matrix[position]
+        return None
+
+@st.cache_resource
+def get_similarity_index() -> SimilarityIndex:
+    return SimilarityIndex()
+
+def _similar_concept_rows(matches: List[Tuple[int, float]]) -> List[Tuple]:
+    if not matches:
+        return []
+    scores = dict(matches)
+    with db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT id, title, industry, created_at FROM movie_concepts "
+            f"WHERE id IN ({','.join('?' * len(scores))})",
+            list(scores)
+        ).fetchall()
+    return sorted((row + (scores[row[0]],) for row in rows), key=lambda row: -row[-1])
+
+def similar_concepts(user_id, concept_id: int, k: int = SIMILAR_CONCEPTS_K,
+                     min_score: float = SIMILAR_MIN_SCORE) -> List[Tuple]:
+    """(id, title, industry, created_at, score) of the user's concepts most like ``concept_id``."""
+    index = get_similarity_index()
+    vector = index.vector(user_id, concept_id)
+    if vector is None:
+        return []
+    matches = index.query(user_id, vector, k, exclude=concept_id)
+    return _similar_concept_rows([(concept_id, score) for concept_id, score in matches if score >= min_score])
+
+def find_similar_to_idea(user_id, movie_idea: str, k: int = SIMILAR_CONCEPTS_K,
+                         threshold: float = SIMILARITY_THRESHOLD) -> List[Tuple]:
+    """Saved concepts close enough to a new idea to offer instead of generating."""
+    matches = get_similarity_index().query(user_id, embed_text(movie_idea), k)
+    return _similar_concept_rows([(concept_id, score) for concept_id, score in matches if score >= threshold])
+
+# Backups: saved concepts stream out as JSON lines (one concept per line,
+# gzip-compressed for *.gz paths) a page at a time, and stream back in with
+# batched executemany inserts, one transaction per batch. Neither side holds
+# more than one batch of concepts in memory (the import also keeps an id map
+# to relink regenerated versions to their parents). Re-importing a concept that already exists
+# (same owner, title and creation time) is a no-op, so restores can be re-run.
+EXPORT_BATCH_SIZE = 500
+IMPORT_BATCH_SIZE = 500
+
+def open_concept_archive(path: str, mode: str = 'rb'):
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+def iter_concept_records(user_id=None, batch_size: int = EXPORT_BATCH_SIZE):
+    """Yield every saved concept (of one user, or all users) as a plain dict."""
+    last_id = 0
+    while True:
+        with db_connection() as conn:
+            rows = conn.execute(
+                "SELECT c.id, u.username, c.title, c.industry, c.concept_data, c.storage_version, c.created_at, "
+                "c.parent_id "
+                "FROM movie_concepts c JOIN users u ON u.id = c.user_id "
+                "WHERE c.id > ? AND (? IS NULL OR c.user_id = ?) ORDER BY c.id LIMIT ?",
+                (last_id, user_id, user_id, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            ids = [row[0] for row in rows]
+            sections: Dict[int, Dict[str, str]] = {}
+            for concept_id, section, data in conn.execute(
+                f"SELECT concept_id, section, data FROM concept_sections "
+                f"WHERE concept_id IN ({','.join('?' * len(ids))})", ids
+            ):
+                sections.setdefault(concept_id, {})[section] = unpack_section(data)
+            structured = load_concept_structured(conn, ids)
+
+        for concept_id, username, title, industry, concept_data, storage_version, created_at, parent_id in rows:
+            data = json.loads(concept_data) if concept_data else {}
+            if storage_version >= CONCEPT_STORAGE_VERSION:
+                data.update(sections.get(concept_id, {}))
+            data.update(structured.get(concept_id, {}))
+            yield {'id': concept_id, 'username': username, 'title': title, 'industry': industry,
+                   'created_at': created_at, 'parent_id': parent_id, 'concept_data': data}
+        last_id = ids[-1]
+
+def export_concepts(out, user_id=None) -> int:
+    """Write concepts as JSON lines to a binary file object; returns the count."""
+    count = 0
+    for record in iter_concept_records(user_id):
+        out.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        count += 1
+    return count
+
+def export_backup_file(user_id):
+    """A user's gzipped backup, spooled to an anonymous temp file and rewound.
+
+    Unbuffered, so Streamlit's download button accepts it as a raw file.
+    """
+    archive = tempfile.TemporaryFile(buffering=0)
+    with gzip.GzipFile(fileobj=archive, mode='wb') as out:
+        export_concepts(out, user_id)
+    archive.seek(0)
+    # On Windows TemporaryFile is a wrapper around the file
+    return getattr(archive, 'file', archive)
+
+def _import_batch(records: List[Dict], user_id, user_ids: Dict[str, Optional[int]],
+                  concept_ids: Dict[int, int]) -> Tuple[int, int]:
+    imported = skipped = 0
+    with db_connection() as conn:
+        # Take the write lock up front: concept ids are allocated from MAX(id)
+        conn.execute("BEGIN IMMEDIATE")
+        concept_rows, section_rows, embedding_rows = [], [], []
+        cast_rows, production_rows, pick_rows = [], [], []
+        seen = {}
+        next_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM movie_concepts").fetchone()[0] + 1
+        for record in records:
+            owner = user_id
+            if owner is None:
+                username = record.get('username')
+                if username not in user_ids:
+                    row = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+                    user_ids[username] = row[0] if row else None
+                owner = user_ids[username]
+            created_at = record.get('created_at') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            key = (owner, created_at, record['title'])
+            existing = seen.get(key) if owner is not None else None
+            if owner is not None and existing is None:
+                row = conn.execute(
+                    "SELECT id FROM movie_concepts WHERE user_id = ? AND created_at = ? AND title = ?",
+                    key
+                ).fetchone()
+                existing = row[0] if row else None
+            if owner is None or existing is not None:
+                # Versions of an already saved concept still link to it
+                if existing is not None and isinstance(record.get('id'), int):
+                    concept_ids[record['id']] = existing
+                skipped += 1
+                continue
+            seen[key] = next_id
+            if isinstance(record.get('id'), int):
+                concept_ids[record['id']] = next_id
+            # Exports are in id order, so a version's parent has been imported (or skipped) already
+            parent_id = concept_ids.get(record.get('parent_id'))
+            metadata, sections = split_concept_data(record['concept_data'])
+            concept_rows.append((next_id, owner, record['title'], record.get('industry'),
+                                 _text(record['concept_data'].get('genre')) or None,
+                                 json.dumps(metadata), CONCEPT_STORAGE_VERSION, created_at, parent_id))
+            section_rows.extend((next_id, section, data) for section, data in sections)
+            embedding_rows.append((next_id, owner, EMBEDDING_VERSION,
+                                   concept_embedding(record['title'], record['concept_data'].get('script')).tobytes()))
+            for rows, new_rows in zip((cast_rows, production_rows, pick_rows),
+                                      concept_structured_rows(next_id, record['concept_data'])):
+                rows.extend(new_rows)
+            next_id += 1
+            imported += 1
+        conn.executemany(
+            "INSERT INTO movie_concepts (id, user_id, title, industry, genre, concept_data, storage_version, "
+            "created_at, parent_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            concept_rows
+        )
+        conn.executemany("INSERT INTO concept_sections (concept_id, section, data) VALUES (?, ?, ?)",
+                         section_rows)
+        conn.executemany(
+            "INSERT INTO concept_embeddings (concept_id, user_id, version, embedding) VALUES (?, ?, ?, ?)",
+            embedding_rows
+        )
+        write_concept_structured(conn, cast_rows, production_rows, pick_rows)
+    for owner in {row[1] for row in concept_rows}:
+        invalidate_user_concepts(owner)
+    return imported, skipped
+
+def _check_concept_record(record: Dict):
+    """Raise ValueError for a record that would fail (and roll back) its import batch."""
+    if not isinstance(record.get('title'), str) or not isinstance(record.get('concept_data'), dict):
+        raise ValueError("missing title or concept_data")
+    for field in ('username', 'industry', 'created_at'):
+        if not isinstance(record.get(field), (str, type(None))):
+            raise ValueError(f"{field} is not a string")
+    for field in ('id', 'parent_id'):
+        if isinstance(record.get(field), bool) or not isinstance(record.get(field), (int, type(None))):
+            raise ValueError(f"{field} is not an integer")
+    for section in CONCEPT_SECTIONS:
+        if not isinstance(record['concept_data'].get(section), (str, type(None))):
+            raise ValueError(f"{section} is not text")
+
+def import_concepts(lines: Iterable, user_id=None, batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, int]:
+    """Import JSON-lines concepts (as produced by export_concepts). With
+    ``user_id`` every concept goes to that user; otherwise each goes to the
+    existing user with its ``username`` and is skipped if there is none.
+    Malformed lines are counted as invalid rather than aborting the import."""
+    counts = {'imported': 0, 'skipped': 0, 'invalid': 0}
+    user_ids: Dict[str, Optional[int]] = {}
+    # Archive concept id -> id here, to remap version lineage (parent_id)
+    concept_ids: Dict[int, int] = {}
+    batch: List[Dict] = []
+
+    def flush():
+        imported, skipped = _import_batch(batch, user_id, user_ids, concept_ids)
+        counts['imported'] += imported
+        counts['skipped'] += skipped
+        batch.clear()
+
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            _check_concept_record(record)
+        except (ValueError, AttributeError):
+            counts['invalid'] += 1
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return counts
+
+# Initialize session state
+if 'user_id' not in st.session_state:
+    st.session_state.user_id = None
+if 'username' not in st.session_state:
+    st.session_state.username = None
+if 'concept_data' not in st.session_state:
+    st.session_state.concept_data = None
+if 'page' not in st.session_state:
+    st.session_state.page = 'login'
+
+# Shared HTTP clients: one pooled keep-alive session per upstream, with
+# retries (exponential backoff + jitter, honouring Retry-After) and a circuit
+# breaker so a failing upstream isn't hammered by every session at once
+HTTP_POOL_CONNECTIONS = int(os.environ.get("CINEAI_HTTP_POOL_CONNECTIONS", 4))
+HTTP_POOL_MAXSIZE = int(os.environ.get("CINEAI_HTTP_POOL_MAXSIZE", 16))
+HTTP_MAX_RETRIES = int(os.environ.get("CINEAI_HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_BASE = float(os.environ.get("CINEAI_HTTP_BACKOFF_BASE", 0.5))
+HTTP_BACKOFF_MAX = float(os.environ.get("CINEAI_HTTP_BACKOFF_MAX", 20))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CINEAI_CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CINEAI_CIRCUIT_RESET_TIMEOUT", 30))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and lets a single
+    trial request through once ``reset_timeout`` has passed."""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Give back a trial slot whose request ended without an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+def _retry_after_seconds(response: requests.Response) -> Optional[float]:
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Admission control for upstream calls. Each upstream has a global token
+# bucket plus one per API key; callers that find no token wait in a bounded
+# queue that is served round-robin across keys, so one busy user can't starve
+# the rest. Waiters are told their queue position as it changes.
+RATE_LIMITS = {
+    'gemini': {
+        'global_rate': float(os.environ.get("CINEAI_GEMINI_GLOBAL_RATE", 5)),
+        'global_burst': int(os.environ.get("CINEAI_GEMINI_GLOBAL_BURST", 10)),
+        'key_rate': float(os.environ.get("CINEAI_GEMINI_KEY_RATE", 0.25)),
+        'key_burst': int(os.environ.get("CINEAI_GEMINI_KEY_BURST", 4))
+    },
+    'serpapi': {
+        'global_rate': float(os.environ.get("CINEAI_SERPAPI_GLOBAL_RATE", 10)),
+        'global_burst': int(os.environ.get("CINEAI_SERPAPI_GLOBAL_BURST", 20)),
+        'key_rate': float(os.environ.get("CINEAI_SERPAPI_KEY_RATE", 2)),
+        'key_burst': int(os.environ.get("CINEAI_SERPAPI_KEY_BURST", 8))
+    }
+}
+ADMISSION_MAX_QUEUE = int(os.environ.get("CINEAI_ADMISSION_MAX_QUEUE", 200))
+ADMISSION_TIMEOUT = float(os.environ.get("CINEAI_ADMISSION_TIMEOUT", 120))
+
+class AdmissionError(requests.RequestException):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class _Waiter:
+    __slots__ = ('key', 'granted')
+
+    def __init__(self, key: str):
+        self.key = key
+        self.granted = False
+
+class AdmissionController:
+    def __init__(self, name: str, global_rate: float, global_burst: int, key_rate: float, key_burst: int,
+                 max_queue: int = ADMISSION_MAX_QUEUE):
+        self.name = name
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.max_queue = max_queue
+        self._global = TokenBucket(global_rate, global_burst)
+        self._buckets: Dict[str, TokenBucket] = {}
+        # Per-key FIFO queues; key order is the round-robin order
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._cond = threading.Condition()
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.key_rate, self.key_burst)
+        return bucket
+
+    def _dispatch(self) -> float:
+        """Grant tokens to waiters in round-robin order; return how long until
+        another grant could become possible."""
+        now = time.monotonic()
+        self._global.refill(now)
+        granted = False
+        progress = True
+        while progress and self._queues:
+            progress = False
+            for key in list(self._queues):
+                bucket = self._bucket(key)
+                bucket.refill(now)
+                if self._global.tokens < 1:
+                    break
+                if bucket.tokens < 1:
+                    continue
+                bucket.tokens -= 1
+                self._global.tokens -= 1
+                queue_ = self._queues.pop(key)
+                queue_.popleft().granted = True
+                if queue_:
+                    # Back of the line for this key's next waiter
+                    self._queues[key] = queue_
+                granted = progress = True
+        if granted:
+            self._cond.notify_all()
+        # Idle buckets are full again after burst / rate seconds; forget them
+        for key in [k for k, b in self._buckets.items()
+                    if k not in self._queues and b.tokens >= b.burst]:
+            del self._buckets[key]
+        if not self._queues:
+            return 1.0
+        key_wait = min(self._bucket(key).wait_time() for key in self._queues)
+        return max(0.01, self._global.wait_time(), key_wait)
+
+    def _position(self, waiter: _Waiter) -> int:
+        index = self._queues[waiter.key].index(waiter)
+        position = index + 1
+        ahead = True
+        for key, queue_ in self._queues.items():
+            if key == waiter.key:
+                ahead = False
+                continue
+            position += min(len(queue_), index + 1 if ahead else index)
+        return position
+
+    def acquire(self, key: str, timeout: float = ADMISSION_TIMEOUT, on_queue=None):
+        deadline = time.monotonic() + timeout
+        waiter = _Waiter(key)
+        with self._cond:
+            if sum(len(queue_) for queue_ in self._queues.values()) >= self.max_queue:
+                raise AdmissionError(f"Too many {self.name} requests are queued, try again shortly")
+            self._queues.setdefault(key, deque()).append(waiter)
+
+        last_position = None
+        try:
+            while True:
+                with self._cond:
+                    delay = self._dispatch()
+                    if waiter.granted:
+                        return
+                    position = self._position(waiter)
+                if on_queue and position != last_position:
+                    on_queue(position)
+                    last_position = position
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionError(f"Timed out waiting in the {self.name} request queue")
+                with self._cond:
+                    if not waiter.granted:
+                        self._cond.wait(min(delay, remaining))
+        finally:
+            with self._cond:
+                if not waiter.granted:
+                    queue_ = self._queues.get(key)
+                    if queue_ and waiter in queue_:
+                        queue_.remove(waiter)
+                        if not queue_:
+                            del self._queues[key]
+                    self._cond.notify_all()
+            if on_queue and last_position is not None:
+                on_queue(None)
+
+def admission_key(api_key: Optional[str]) -> str:
+    # Keys are only used for bucketing, so don't keep them around in memory
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+class UpstreamClient:
+    def __init__(self, name: str, pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE, max_retries: int = HTTP_MAX_RETRIES,
+                 backoff_base: float = HTTP_BACKOFF_BASE, backoff_max: float = HTTP_BACKOFF_MAX,
+                 admission: Optional[AdmissionController] = None):
+        self.name = name
+        self.admission = admission
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method: str, url: str, rate_key: Optional[str] = None, on_queue=None,
+                **kwargs) -> requests.Response:
+        """Send a request; ``rate_key`` selects the caller's rate limit bucket and
+        ``on_queue(position)`` is told about queueing (None once admitted)."""
+        metrics = get_metrics()
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                metrics.inc("cineai_upstream_retries_total", upstream=self.name)
+            # Admission first: a half-open breaker's single trial slot must not
+            # be held by a request that is still queueing (or times out there)
+            if self.admission is not None:
+                wait_start = time.perf_counter()
+                try:
+                    self.admission.acquire(admission_key(rate_key), on_queue=on_queue)
+                except AdmissionError:
+                    metrics.inc("cineai_upstream_rejections_total", upstream=self.name, reason='admission')
+                    raise
+                metrics.observe("cineai_admission_wait_seconds", time.perf_counter() - wait_start,
+                                upstream=self.name)
+            if not self.breaker.allow():
+                metrics.inc("cineai_upstream_rejections_total", upstream=self.name, reason='circuit_open')
+                raise CircuitOpenError(
+                    f"{self.name} is temporarily unavailable after repeated failures, try again shortly"
+                )
+
+            last_attempt = attempt == self.max_retries
+            recorded = False
+            start = time.perf_counter()
+            try:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    metrics.observe("cineai_upstream_request_seconds", time.perf_counter() - start,
+                                    upstream=self.name, outcome=type(e).__name__)
+                    self.breaker.record_failure()
+                    recorded = True
+                    if last_attempt:
+                        raise
+                    delay = self._backoff(attempt)
+                else:
+                    # For streamed responses this is time to headers, not to the last byte
+                    metrics.observe("cineai_upstream_request_seconds", time.perf_counter() - start,
+                                    upstream=self.name, outcome=str(response.status_code))
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        self.breaker.record_success()
+                        recorded = True
+                        return response
+
+                    # A 429 is one caller's key out of quota, not the upstream failing:
+                    # retry it, but don't let it open the breaker for everyone
+                    if response.status_code != 429:
+                        self.breaker.record_failure()
+                        recorded = True
+                    delay = _retry_after_seconds(response)
+                    # Hand the error response back rather than sleeping past our budget
+                    if last_attempt or (delay is not None and delay > self.backoff_max):
+                        return response
+                    response.close()
+                    if delay is None:
+                        delay = self._backoff(attempt)
+            finally:
+                # Any other exception leaves no outcome; don't strand the trial slot
+                if not recorded:
+                    self.breaker.release_trial()
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+@st.cache_resource
+def get_http_client(upstream: str) -> UpstreamClient:
+    admission = None
+    if upstream in RATE_LIMITS:
+        admission = AdmissionController(upstream, **RATE_LIMITS[upstream])
+    return UpstreamClient(upstream, admission=admission)
+
+# Single-flight. Identical upstream requests in flight at the same time are
+# made once. Within a process, followers wait for the leader's flight and
+# take its result. Across processes sharing movie_agent.db, the leader holds
+# a lease row in upstream_leases while followers poll the shared cache the
+# leader fills (the ``lookup`` callback). A lease expires after its TTL, so a
+# crashed leader only delays the others, one of which then takes over.
+SINGLE_FLIGHT_LEASE_TTL = float(os.environ.get("CINEAI_SINGLE_FLIGHT_LEASE_TTL", 30))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.environ.get("CINEAI_SINGLE_FLIGHT_POLL_INTERVAL", 0.1))
+
+class _Flight:
+    def __init__(self):
+        self.result = None
+        self.done = threading.Event()
+
+class SingleFlight:
+    def __init__(self, lease_ttl: float = SINGLE_FLIGHT_LEASE_TTL,
+                 poll_interval: float = SINGLE_FLIGHT_POLL_INTERVAL):
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _acquire_lease(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        with db_connection() as conn:
+            return conn.execute(
+                "INSERT INTO upstream_leases (lease_key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (lease_key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE upstream_leases.expires_at < ?",
+                (key, self.owner, now + ttl, now)
+            ).rowcount == 1
+
+    def _release_lease(self, key: str):
+        with db_connection() as conn:
+            conn.execute("DELETE FROM upstream_leases WHERE lease_key = ? AND owner = ?", (key, self.owner))
+
+    @contextmanager
+    def lead(self, key: str, lookup, lease_ttl: Optional[float] = None,
+             cancel_event: Optional[threading.Event] = None):
+        """Wait until this caller may make the request for ``key``.
+
+        Yields a flight. If its ``result`` is already set, another caller made
+        the request and that is the answer. Otherwise this caller is the
+        leader: it makes the request and sets ``result`` for its in-process
+        followers (who otherwise try to lead themselves once it is done).
+        """
+        upstream = key.split(':', 1)[0]
+        cancelled = lambda: cancel_event is not None and cancel_event.is_set()
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leading = flight is None
+                if leading:
+                    flight = self._flights[key] = _Flight()
+            if leading:
+                break
+            while not flight.done.wait(self.poll_interval):
+                if cancelled():
+                    yield _Flight()
+                    return
+            if flight.result is not None:
+                get_metrics().inc("cineai_single_flight_total", upstream=upstream, role='follower', scope='process')
+                yield flight
+                return
+
+        leased = False
+        try:
+            with timed('cineai_single_flight_wait', upstream=upstream):
+                while not cancelled():
+                    leased = self._acquire_lease(key, lease_ttl or self.lease_ttl)
+                    # Even with the lease, another process may have just finished
+                    flight.result = lookup()
+                    if leased or flight.result is not None:
+                        break
+                    time.sleep(self.poll_interval)
+            role = 'leader' if flight.result is None else 'follower'
+            get_metrics().inc("cineai_single_flight_total", upstream=upstream, role=role, scope='cluster')
+            yield flight
+        finally:
+            if leased:
+                self._release_lease(key)
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def do(self, key: str, fn, lookup, lease_ttl: Optional[float] = None, shareable=None):
+        """Return fn() for the leader and the leader's result for its followers.
+
+        Results failing ``shareable`` (e.g. an error from the leader's own API
+        key) go back to the leader only; its followers then try to lead.
+        """
+        with self.lead(key, lookup, lease_ttl) as flight:
+            if flight.result is not None:
+                return flight.result
+            result = fn()
+            if shareable is None or shareable(result):
+                flight.result = result
+            return result
+
+@st.cache_resource
+def get_single_flight() -> SingleFlight:
+    return SingleFlight()
+
+# Improved Gemini API call
+GEMINI_MODEL_URL = os.environ.get("CINEAI_GEMINI_MODEL_URL",
+                                  "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash")
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.8,
+    "topK": 40,
+    "topP": 0.95,
+    "maxOutputTokens": 4096
+}
+
+def gemini_generation_config(response_schema: Optional[Dict] = None) -> Dict:
+    if response_schema is None:
+        return GEMINI_GENERATION_CONFIG
+    return dict(GEMINI_GENERATION_CONFIG, responseMimeType="application/json", responseSchema=response_schema)
+
+# Generation cache: identical prompts with identical generation settings are
+# answered from movie_agent.db instead of calling Gemini again
+GENERATION_CACHE_MAX_BYTES = int(os.environ.get("CINEAI_GENERATION_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+def normalize_prompt(prompt: str) -> str:
+    lines = prompt.replace('\r\n', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+def generation_cache_key(prompt: str, generation_config: Dict = GEMINI_GENERATION_CONFIG) -> str:
+    payload = json.dumps({
+        'model': GEMINI_MODEL_URL,
+        'prompt': normalize_prompt(prompt),
+        'generationConfig': generation_config
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class GenerationCache:
+    def __init__(self, max_bytes: int = GENERATION_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+    def get(self, cache_key: str) -> Optional[str]:
+        with db_connection() as conn:
+            row = conn.execute("SELECT response FROM generation_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE generation_cache SET last_access = ? WHERE cache_key = ?",
+                    (time.time(), cache_key)
+                )
+        record_cache_lookup('generation', 'hit' if row else 'miss')
+        return row[0] if row else None
+
+    def peek(self, cache_key: str) -> Optional[str]:
+        # For single-flight followers polling for a leader's result: no stats, no LRU bump
+        with db_connection() as conn:
+            row = conn.execute("SELECT response FROM generation_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, cache_key: str, response: str):
+        now = time.time()
+        with db_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO generation_cache (cache_key, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (cache_key, response, len(response.encode('utf-8')), now, now)
+            )
+            # Evict least recently used entries beyond the size budget
+            conn.execute('''
+                DELETE FROM generation_cache WHERE cache_key IN (
+                    SELECT cache_key FROM (
+                        SELECT cache_key, SUM(size) OVER (ORDER BY last_access DESC, cache_key) AS running
+                        FROM generation_cache
+                    ) WHERE running > ?
+                )
+            ''', (self.max_bytes,))
+
+@st.cache_resource
+def get_generation_cache() -> GenerationCache:
+    return GenerationCache()
+
+def record_gemini_usage(usage: Optional[Dict]):
+    if not usage:
+        return
+    metrics = get_metrics()
+    for field, kind in (('promptTokenCount', 'prompt'), ('candidatesTokenCount', 'output')):
+        if usage.get(field):
+            metrics.inc("cineai_gemini_tokens_total", usage[field], kind=kind)
+
+# Gemini calls are slow, so their leases outlive the default
+GEMINI_LEASE_TTL = float(os.environ.get("CINEAI_GEMINI_LEASE_TTL", 120))
+
+def call_gemini_api(api_key: str, prompt: str, use_cache: bool = True,
+                    generation_config: Dict = GEMINI_GENERATION_CONFIG) -> Optional[str]:
+    cache_key = generation_cache_key(prompt, generation_config)
+    try:
+        if not use_cache:
+            return _generate_content(api_key, prompt, generation_config, cache_key)
+        cached = get_generation_cache().get(cache_key)
+        if cached is not None:
+            return cached
+        # Duplicate clicks (in any app process) wait for the first request instead of repeating it
+        return get_single_flight().do(
+            f"gemini:{cache_key}", lambda: _generate_content(api_key, prompt, generation_config, cache_key),
+            lambda: get_generation_cache().peek(cache_key), lease_ttl=GEMINI_LEASE_TTL
+        )
+    except Exception as e:
+        st.error(f"❌ Gemini API Error: {str(e)}")
+        return None
+
+def _generate_content(api_key: str, prompt: str, generation_config: Dict, cache_key: str) -> Optional[str]:
+    url = f"{GEMINI_MODEL_URL}:generateContent"
+    headers = {
+        'Content-Type': 'application/json',
+        'X-goog-api-key': api_key
+    }
+    data = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": generation_config
+    }
+    
+    response = get_http_client('gemini').post(url, headers=headers, json=data, timeout=60,
+                                              rate_key=api_key)
+    response.raise_for_status()
+    
+    result = response.json()
+    record_gemini_usage(result.get('usageMetadata'))
+    if result.get('candidates') and result['candidates'][0].get('content'):
+        text = result['candidates'][0]['content']['parts'][0]['text']
+        get_generation_cache().put(cache_key, text)
+        return text
+    
+    return None
+
+# Streaming Gemini API call (server-sent events). Unlike call_gemini_api this
+# raises on failure, so it can be used off the Streamlit script thread.
+# Setting cancel_event stops the stream and closes the connection. Cache hits
+# are yielded as a single chunk; only fully streamed responses are cached.
+# With the cache on, an identical stream already running elsewhere is waited
+# for and its result yielded as a single chunk too.
+def stream_gemini_api(api_key: str, prompt: str, cancel_event: Optional[threading.Event] = None,
+                      use_cache: bool = True, on_queue=None,
+                      generation_config: Dict = GEMINI_GENERATION_CONFIG):
+    cache_key = generation_cache_key(prompt, generation_config)
+    if not use_cache:
+        yield from _stream_generate_content(api_key, prompt, generation_config, cache_key,
+                                            cancel_event, on_queue)
+        return
+    cached = get_generation_cache().get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+    with get_single_flight().lead(f"gemini:{cache_key}", lambda: get_generation_cache().peek(cache_key),
+                                  lease_ttl=GEMINI_LEASE_TTL, cancel_event=cancel_event) as flight:
+        if flight.result is not None:
+            yield flight.result
+            return
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        chunks = []
+        for chunk in _stream_generate_content(api_key, prompt, generation_config, cache_key,
+                                              cancel_event, on_queue):
+            chunks.append(chunk)
+            yield chunk
+        # A cancelled stream is partial; followers must not take it
+        if cancel_event is None or not cancel_event.is_set():
+            flight.result = ''.join(chunks) or None
+
+def _stream_generate_content(api_key: str, prompt: str, generation_config: Dict, cache_key: str,
+                             cancel_event: Optional[threading.Event], on_queue):
+    url = f"{GEMINI_MODEL_URL}:streamGenerateContent"
+    headers = {
+        'Content-Type': 'application/json',
+        'X-goog-api-key': api_key
+    }
+    data = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": generation_config
+    }
+
+    stream_start = time.perf_counter()
+    response = get_http_client('gemini').post(url, params={'alt': 'sse'}, headers=headers, json=data,
+                                              stream=True, timeout=60, rate_key=api_key,
+                                              on_queue=on_queue)
+    chunks = []
+    usage = None
+    with response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            if not line.startswith(b'data:'):
+                continue
+            chunk = json.loads(line[5:].decode('utf-8'))
+            # Cumulative; the last chunk carries the totals
+            usage = chunk.get('usageMetadata') or usage
+            candidates = chunk.get('candidates') or []
+            if not candidates or not candidates[0].get('content'):
+                continue
+            for part in candidates[0]['content'].get('parts', []):
+                if part.get('text'):
+                    if not chunks:
+                        get_metrics().observe("cineai_gemini_first_token_seconds",
+                                              time.perf_counter() - stream_start)
+                    chunks.append(part['text'])
+                    yield part['text']
+
+    record_gemini_usage(usage)
+    if chunks:
+        get_generation_cache().put(cache_key, ''.join(chunks))
+
+# Actor name extraction. One precompiled tokenizer pass over the casting text
+# feeds two matchers: a token trie of known actors (known_actors.txt, built
+# once per process) and a fallback for other capitalised 2-4 word names.
+# Known actors come first, each group in order of first mention.
+KNOWN_ACTORS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'known_actors.txt')
+ACTOR_NAME_LIMIT = 6
+
+# Words, including initials ("L.", "J.K."), hyphenated and apostrophised
+# names. A period only belongs to a single-letter initial; any other is a
+# sentence end.
+_NAME_TOKEN_RE = re.compile(r"(?:[^\W\d_]\.)+|[^\W\d_]+(?:['’-][^\W\d_]+)*")
+_NAME_GAP_RE = re.compile(r"[ \t\u00a0]+")
+# "He's", "Ranveer's", "they'll": the stem may end a name but never continues one
+_CONTRACTION_RE = re.compile(r"['’](?:s|re|ve|ll|d|t|m)$", re.IGNORECASE)
+# Film titles are usually quoted or italicised ("Gully Boy", *Sita Ramam*, _Dangal_)
+_TITLE_SPAN_RE = re.compile(r'"[^"\n]+"|“[^”\n]+”|(?<![*\w])\*(?=[^\s*])[^*\n]+?(?<=[^\s*])\*(?![*\w])'
+                            r'|(?<!\w)_(?=\S)[^_\n]+?(?<=\S)_(?!\w)')
+_NAME_STOPWORDS = frozenset("""
+    a an the and or of for with as in on at by to from is are was his her their
+    he she they it we you i him them this that these those while but though although however if when also
+    lead leads role roles supporting character characters cast casting actor actress actors
+    main key option options alternative alternatives choice choices why reason reasons note notes
+    potential chemistry current availability diversity considerations consideration suitability
+    box office market research social media recent projects project age experience newcomer
+    acting style previous marketability popularity draw perfect think
+    act scene scenes director directors budget production marketing strategy
+    hollywood bollywood indian american british international award awards academy oscar
+    film films movie movies series star stars young older villain hero heroine protagonist antagonist
+    mr mrs ms dr minister inspector officer detective captain professor doctor
+""".split())
+
+def _name_key(token: str) -> str:
+    return token.casefold().rstrip('.')
+
+def _is_sub_run(tokens: List[str], other: List[str]) -> bool:
+    return len(tokens) < len(other) and any(
+        other[i:i + len(tokens)] == tokens for i in range(len(other) - len(tokens) + 1)
+    )
+
+class ActorNameExtractor:
+    def __init__(self, known_names: List[str]):
+        self._trie: Dict = {}
+        for name in known_names:
+            node = self._trie
+            for token in _NAME_TOKEN_RE.findall(name):
+                node = node.setdefault(_name_key(token), {})
+            node[None] = name
+
+    def _tokenize(self, text: str) -> List[Tuple[str, bool, bool]]:
+        # (token, joined to the previous token by plain spaces, ends any name it is in)
+        text = _TITLE_SPAN_RE.sub('\n', text)
+        tokens = []
+        previous_end = None
+        for match in _NAME_TOKEN_RE.finditer(text):
+            joined = (previous_end is not None and
+                      _NAME_GAP_RE.fullmatch(text, previous_end, match.start()) is not None)
+            token = match.group()
+            contraction = _CONTRACTION_RE.search(token)
+            if contraction:
+                token = token[:contraction.start()]
+            tokens.append((token, joined, contraction is not None))
+            previous_end = match.end()
+        return tokens
+
+    def _known_at(self, tokens: List[Tuple[str, bool, bool]], start: int) -> Tuple[Optional[str], int]:
+        node, name, end = self._trie, None, start
+        for i in range(start, len(tokens)):
+            if i > start and (not tokens[i][1] or tokens[i - 1][2]):
+                break
+            node = node.get(_name_key(tokens[i][0]))
+            if node is None:
+                break
+            if None in node:
+                name, end = node[None], i + 1
+        return name, end
+
+    def extract(self, text: str, limit: int = ACTOR_NAME_LIMIT) -> List[str]:
+        tokens = self._tokenize(text)
+        known, candidates = {}, {}
+        run: List[str] = []
+
+        def close_run():
+            if 2 <= len(run) <= 4:
+                name = " ".join(run)
+                candidates.setdefault(name.casefold(), name)
+            run.clear()
+
+        i = 0
+        while i < len(tokens):
+            name, end = self._known_at(tokens, i)
+            if name:
+                close_run()
+                known.setdefault(name, None)
+                i = end
+                continue
+
+            token, joined, final = tokens[i]
+            if not joined:
+                close_run()
+            if token[0].isupper() and _name_key(token) not in _NAME_STOPWORDS:
+                run.append(token)
+            else:
+                close_run()
+            if final:
+                close_run()
+            i += 1
+        close_run()
+
+        # "Kay Kay" is only a fragment of "Kay Kay Menon"
+        accepted = [name.casefold().split() for name in known] + [key.split() for key in candidates]
+        names = list(known) + [
+            name for key, name in candidates.items()
+            if key not in {n.casefold() for n in known} and
+            not any(_is_sub_run(key.split(), other) for other in accepted)
+        ]
+        return names[:limit]
+
+def load_known_actors(path: str = KNOWN_ACTORS_PATH) -> List[str]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = [line.strip() for line in f]
+    except FileNotFoundError:
+        return []
+    return [line for line in lines if line and not line.startswith('#')]
+
+@st.cache_resource
+def get_actor_extractor() -> ActorNameExtractor:
+    return ActorNameExtractor(load_known_actors())
+
+def extract_actor_names(text: str) -> List[str]:
+    key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    names = get_memo('actor_names').get_or_compute(key, lambda: get_actor_extractor().extract(text))
+    return list(names)
+
+# Structured casting names its actors outright: take each character's top
+# pick first, then the runners-up. Older free-text casting is scraped.
+def concept_actor_names(concept_data: Dict) -> List[str]:
+    cast = concept_data.get('cast')
+    if not cast:
+        return extract_actor_names(concept_data.get('casting', ''))
+    names = []
+    for rank in range(max(len(role['actors']) for role in cast)):
+        names.extend(role['actors'][rank] for role in cast if rank < len(role['actors']))
+    return list(dict.fromkeys(names))[:ACTOR_NAME_LIMIT]
+
+# Real actor research with SerpAPI
+SERPAPI_URL = os.environ.get("CINEAI_SERPAPI_URL", "https://serpapi.com/search")
+
+def fetch_actor_info(actor_name: str, api_key: str, industry: str, on_queue=None) -> Dict:
+    try:
+        if industry == "Bollywood":
+            search_query = f"{actor_name} Bollywood actor latest movies 2024 new projects filmography"
+        else:
+            search_query = f"{actor_name} Hollywood actor latest movies 2024 new projects filmography"
+        
+        params = {
+            'q': search_query,
+            'api_key': api_key,
+            'engine': 'google',
+            'num': 8
+        }
+        
+        with timed('cineai_serpapi_call', kind='actor'):
+            response = get_http_client('serpapi').get(SERPAPI_URL, params=params, timeout=20,
+                                                      rate_key=api_key, on_queue=on_queue)
+            response.raise_for_status()
+            data = response.json()
+        
+        actor_info = {
+            'name': actor_name,
+            'latest_projects': [],
+            'news': [],
+            'status': 'Active'
+        }
+        
+        # Process organic results
+        organic_results = data.get('organic_results', [])
+        for result in organic_results[:5]:
+            if any(keyword in result.get('title', '').lower() for keyword in ['movie', 'film', 'series', 'project']):
+                actor_info['latest_projects'].append({
+                    'title': result.get('title', ''),
+                    'description': result.get('snippet', ''),
+                    'link': result.get('link', '')
+                })
+        
+        # Process news results if available
+        news_results = data.get('news_results', [])
+        for news in news_results[:3]:
+            actor_info['news'].append({
+                'title': news.get('title', ''),
+                'summary': news.get('snippet', ''),
+                'source': news.get('source', ''),
+                'date': news.get('date', ''),
+                'link': news.get('link', '')
+            })
+        
+        return actor_info
+        
+    except Exception as e:
+        return {'name': actor_name, 'error': f"Research failed: {str(e)}"}
+
+# Actor research cache (shared by all sessions, persisted in movie_agent.db)
+ACTOR_CACHE_TTL = int(os.environ.get("CINEAI_ACTOR_CACHE_TTL", 24 * 3600))
+ACTOR_CACHE_STALE_TTL = int(os.environ.get("CINEAI_ACTOR_CACHE_STALE_TTL", 7 * 24 * 3600))
+ACTOR_CACHE_MAX_ENTRIES = int(os.environ.get("CINEAI_ACTOR_CACHE_MAX_ENTRIES", 1000))
+ACTOR_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("CINEAI_ACTOR_CACHE_DISK_MAX_ENTRIES", 20000))
+
+def normalize_actor_name(actor_name: str) -> str:
+    return " ".join(actor_name.split()).casefold()
+
+class ActorInfoCache:
+    """In-memory LRU in front of the actor_cache table.
+
+    Entries younger than ``ttl`` are fresh. Entries older than that but
+    younger than ``ttl + stale_ttl`` are served immediately while a
+    background refresh replaces them; anything older is refetched inline.
+    """
+
+    def __init__(self, ttl: int = ACTOR_CACHE_TTL,
+                 stale_ttl: int = ACTOR_CACHE_STALE_TTL, max_entries: int = ACTOR_CACHE_MAX_ENTRIES,
+                 disk_max_entries: int = ACTOR_CACHE_DISK_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Dict, float]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _remember(self, key: Tuple[str, str], actor_info: Dict, fetched_at: float):
+        with self._lock:
+            self._entries[key] = (actor_info, fetched_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key: Tuple[str, str]) -> Optional[Tuple[Dict, float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                return entry
+
+        with db_connection() as conn:
+            row = conn.execute(
+                "SELECT actor_info, fetched_at FROM actor_cache WHERE actor_key = ? AND industry = ?",
+                key
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                "UPDATE actor_cache SET last_access = ? WHERE actor_key = ? AND industry = ?",
+                (time.time(), *key)
+            )
+
+        entry = (json.loads(row[0]), row[1])
+        self._remember(key, *entry)
+        return entry
+
+    def store(self, actor_name: str, industry: str, actor_info: Dict):
+        key = (normalize_actor_name(actor_name), industry)
+        now = time.time()
+        self._remember(key, actor_info, now)
+
+        with db_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO actor_cache (actor_key, industry, actor_info, fetched_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (*key, json.dumps(actor_info), now, now)
+            )
+            conn.execute(
+                "DELETE FROM actor_cache WHERE rowid NOT IN "
+                "(SELECT rowid FROM actor_cache ORDER BY last_access DESC LIMIT ?)",
+                (self.disk_max_entries,)
+            )
+
+    def _lookup_fresh(self, key: Tuple[str, str]) -> Optional[Dict]:
+        # What another process's fetch of this actor would leave behind
+        with db_connection() as conn:
+            row = conn.execute(
+                "SELECT actor_info, fetched_at FROM actor_cache WHERE actor_key = ? AND industry = ?",
+                key
+            ).fetchone()
+        if not row or time.time() - row[1] >= self.ttl:
+            return None
+        actor_info = json.loads(row[0])
+        self._remember(key, actor_info, row[1])
+        return actor_info
+
+    def _fetch(self, key: Tuple[str, str], actor_name: str, api_key: str, industry: str,
+               on_queue=None) -> Dict:
+        def fetch():
+            actor_info = fetch_actor_info(actor_name, api_key, industry, on_queue)
+            if 'error' not in actor_info:
+                self.store(actor_name, industry, actor_info)
+            return actor_info
+        return get_single_flight().do(f"actor:{industry}:{key[0]}", fetch, lambda: self._lookup_fresh(key),
+                                      shareable=lambda actor_info: 'error' not in actor_info)
+
+    def _refresh(self, key: Tuple[str, str], actor_name: str, api_key: str, industry: str):
+        # Errors are not stored, so a failed refresh keeps serving the stale entry
+        try:
+            self._fetch(key, actor_name, api_key, industry)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, actor_name: str, api_key: str, industry: str, on_queue=None) -> Dict:
+        key = (normalize_actor_name(actor_name), industry)
+        entry = self._load(key)
+
+        if entry:
+            actor_info, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                record_cache_lookup('actor', 'hit')
+                return actor_info
+            if age < self.ttl + self.stale_ttl:
+                record_cache_lookup('actor', 'stale')
+                with self._lock:
+                    should_refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                if should_refresh:
+                    threading.Thread(
+                        target=self._refresh,
+                        args=(key, actor_name, api_key, industry),
+                        daemon=True
+                    ).start()
+                return actor_info
+
+        record_cache_lookup('actor', 'miss')
+        return self._fetch(key, actor_name, api_key, industry, on_queue)
+
+@st.cache_resource
+def get_actor_cache() -> ActorInfoCache:
+    return ActorInfoCache()
+
+def search_actor_info(actor_name: str, api_key: str, industry: str, on_queue=None) -> Dict:
+    return get_actor_cache().get(actor_name, api_key, industry, on_queue)
+
+# Concurrent actor research
+ACTOR_RESEARCH_MAX_WORKERS = int(os.environ.get("CINEAI_ACTOR_RESEARCH_MAX_WORKERS", 4))
+ACTOR_RESEARCH_TIMEOUT = int(os.environ.get("CINEAI_ACTOR_RESEARCH_TIMEOUT", 30))
+
+ACTOR_QUEUE_POLL_INTERVAL = 0.25
+
+def search_actors_info(actor_names: List[str], api_key: str, industry: str,
+                       max_workers: int = ACTOR_RESEARCH_MAX_WORKERS,
+                       timeout: float = ACTOR_RESEARCH_TIMEOUT, on_queue=None):
+    """Research several actors at once, yielding (actor_name, actor_info) pairs
+    in completion order so callers can render each result as soon as it lands.
+
+    ``on_queue(actor_name, position)`` is told about SerpAPI queueing (None
+    once admitted). It is called on the caller's thread, between results, so
+    it may update Streamlit elements.
+    """
+    if not actor_names:
+        return
+
+    updates = queue.Queue()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(actor_names))))
+    futures = {
+        executor.submit(search_actor_info, actor_name, api_key, industry,
+                        (lambda position, actor_name=actor_name: updates.put((actor_name, position)))
+                        if on_queue else None): actor_name
+        for actor_name in actor_names
+    }
+    deadline = time.monotonic() + timeout
+    pending = set(futures)
+    finished = set()
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED,
+                                 timeout=min(remaining, ACTOR_QUEUE_POLL_INTERVAL) if on_queue else remaining)
+            while not updates.empty():
+                actor_name, position = updates.get_nowait()
+                if actor_name not in finished:
+                    on_queue(actor_name, position)
+            for future in done:
+                finished.add(futures[future])
+                yield futures[future], _actor_result(future, futures[future])
+        for future in pending:
+            actor_name = futures[future]
+            if future.done():
+                yield actor_name, _actor_result(future, actor_name)
+            else:
+                yield actor_name, {'name': actor_name, 'error': f"Research timed out after {timeout}s"}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _actor_result(future, actor_name: str) -> Dict:
+    try:
+        return future.result()
+    except Exception as e:
+        return {'name': actor_name, 'error': f"Research failed: {str(e)}"}
+
+# Real industry trends research
+def get_industry_trends(api_key: str, industry: str) -> Dict:
+    try:
+        if industry == "Bollywood":
+            search_query = "Bollywood 2024 box office hits trends new movies Indian cinema industry news"
+        else:
+            search_query = "Hollywood 2024 box office hits trends new movies industry news"
+        
+        params = {
+            'q': search_query,
+            'api_key': api_key,
+            'engine': 'google',
+            'num': 10,
+            'tbm': 'nws'
+        }
+        
+        with timed('cineai_serpapi_call', kind='trends'):
+            response = get_http_client('serpapi').get(SERPAPI_URL, params=params, timeout=20,
+                                                      rate_key=api_key)
+            response.raise_for_status()
+            data = response.json()
+        
+        trends = {
+            'latest_news': [],
+            'market_trends': [],
+            'successful_films': []
+        }
+        
+        # Process news results
+        news_results = data.get('news_results', [])
+        for news in news_results[:6]:
+            trends['latest_news'].append({
+                'title': news.get('title', ''),
+                'summary': news.get('snippet', ''),
+                'source': news.get('source', ''),
+                'date': news.get('date', ''),
+                'link': news.get('link', '')
+            })
+        
+        return trends
+        
+    except Exception as e:
+        return {'error': f"Trends research failed: {str(e)}"}
+
+# Shared industry trends. The trends query is the same for every user, so one
+# process-wide store serves all sessions. Only an operator key
+# (CINEAI_SERPAPI_KEY) is used for the background scheduler that refreshes
+# each industry once per interval; a session's own key is never kept, it only
+# pays for an inline fetch when that session finds the store cold or stale.
+# Failed fetches are remembered per key for TRENDS_ERROR_TTL, so a bad key
+# doesn't cost a SerpAPI call on every rerun.
+TRENDS_REFRESH_INTERVAL = int(os.environ.get("CINEAI_TRENDS_REFRESH_INTERVAL", 3600))
+TRENDS_ERROR_TTL = int(os.environ.get("CINEAI_TRENDS_ERROR_TTL", 60))
+TRENDS_INDUSTRIES = ("Hollywood", "Bollywood")
+
+class TrendsStore:
+    def __init__(self, refresh_interval: int = TRENDS_REFRESH_INTERVAL,
+                 api_key: Optional[str] = os.environ.get("CINEAI_SERPAPI_KEY"),
+                 error_ttl: int = TRENDS_ERROR_TTL):
+        self.refresh_interval = refresh_interval
+        self.api_key = api_key
+        self.error_ttl = error_ttl
+        self._entries: Dict[str, Tuple[Dict, float]] = {}
+        # (industry, admission_key(api_key)) -> (error, failed_at)
+        self._errors: Dict[Tuple[str, str], Tuple[Dict, float]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._scheduler = None
+
+    def peek(self, industry: str) -> Optional[Tuple[Dict, float]]:
+        with self._lock:
+            entry = self._entries.get(industry)
+        if entry:
+            return entry
+        with db_connection() as conn:
+            row = conn.execute(
+                "SELECT trends, fetched_at FROM industry_trends WHERE industry = ?",
+                (industry,)
+            ).fetchone()
+        if not row:
+            return None
+        entry = (json.loads(row[0]), row[1])
+        with self._lock:
+            self._entries.setdefault(industry, entry)
+        return entry
+
+    def store(self, industry: str, trends: Dict):
+        fetched_at = time.time()
+        with self._lock:
+            self._entries[industry] = (trends, fetched_at)
+        with db_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO industry_trends (industry, trends, fetched_at) VALUES (?, ?, ?)",
+                (industry, json.dumps(trends), fetched_at)
+            )
+
+    def _lookup_fresh(self, industry: str) -> Optional[Tuple[Dict, float]]:
+        # Another process (or its scheduler) may have refreshed this industry meanwhile
+        with db_connection() as conn:
+            row = conn.execute(
+                "SELECT trends, fetched_at FROM industry_trends WHERE industry = ?",
+                (industry,)
+            ).fetchone()
+        if not row or time.time() - row[1] >= self.refresh_interval:
+            return None
+        entry = (json.loads(row[0]), row[1])
+        with self._lock:
+            self._entries[industry] = entry
+        return entry
+
+    def _recent_error(self, industry: str, api_key: str) -> Optional[Dict]:
+        with self._lock:
+            error = self._errors.get((industry, admission_key(api_key)))
+        if error and time.time() - error[1] < self.error_ttl:
+            return error[0]
+        return None
+
+    def _fetch(self, industry: str, api_key: str) -> Tuple[Dict, Optional[float]]:
+        trends = get_industry_trends(api_key, industry)
+        if 'error' in trends:
+            now = time.time()
+            with self._lock:
+                for key in [k for k, (_, failed_at) in self._errors.items() if now - failed_at >= self.error_ttl]:
+                    del self._errors[key]
+                self._errors[(industry, admission_key(api_key))] = (trends, now)
+            return trends, None
+        self.store(industry, trends)
+        return trends, time.time()
+
+    def refresh(self, industry: str, api_key: str) -> Tuple[Dict, Optional[float]]:
+        return get_single_flight().do(f"trends:{industry}", lambda: self._fetch(industry, api_key),
+                                      lambda: self._lookup_fresh(industry),
+                                      shareable=lambda result: result[1] is not None)
+
+    def get(self, industry: str, api_key: str) -> Tuple[Dict, Optional[float]]:
+        """Return (trends, fetched_at). Stale trends are kept while a refresh fails."""
+        entry = self.peek(industry)
+        # With an operator key the scheduler keeps entries fresh
+        if entry and (self.api_key or time.time() - entry[1] < self.refresh_interval):
+            return entry
+        error = self._recent_error(industry, api_key)
+        if error is None:
+            trends, fetched_at = self.refresh(industry, api_key)
+            if fetched_at is not None:
+                return trends, fetched_at
+            error = trends
+        return entry or (error, None)
+
+    def _run_scheduler(self):
+        check_interval = min(60, self.refresh_interval)
+        while not self._stop.is_set():
+            for industry in TRENDS_INDUSTRIES:
+                entry = self.peek(industry)
+                if entry is None or time.time() - entry[1] >= self.refresh_interval:
+                    self.refresh(industry, self.api_key)
+            self._stop.wait(check_interval)
+
+    def start(self):
+        # Scheduled refreshes are charged to the operator, never to a user's key
+        if self.api_key and self._scheduler is None:
+            self._scheduler = threading.Thread(target=self._run_scheduler, name="trends-scheduler",
+                                               daemon=True)
+            self._scheduler.start()
+
+    def stop(self):
+        self._stop.set()
+
+@st.cache_resource
+def get_trends_store() -> TrendsStore:
+    store = TrendsStore()
+    store.start()
+    return store
+
+# Concept generation prompts
+def build_script_prompt(industry: str, genre: str, target_audience: str, runtime: int,
+                        movie_idea: str, concept_title: str) -> str:
+    return f"""Create a detailed script outline for a {industry} {genre} movie:
+
+Title: {concept_title}
+Industry: {industry}
+Genre: {genre}
+Audience: {target_audience}
+Runtime: {runtime} minutes
+Idea: {movie_idea}
+
+Include: 3-act structure, character descriptions, key plot points, and twists."""
+
+# Prompt assembly. Later stages only see the parts of earlier outputs they
+# need: casting gets the script's character section, production gets the
+# script's premise and a one-line-per-role casting summary. Each piece has a
+# token budget; text over budget is cut at the last paragraph, line or
+# sentence break that fits rather than mid-sentence.
+CHARS_PER_TOKEN = 4
+CASTING_CONTEXT_TOKENS = int(os.environ.get("CINEAI_CASTING_CONTEXT_TOKENS", 600))
+PRODUCTION_PREMISE_TOKENS = int(os.environ.get("CINEAI_PRODUCTION_PREMISE_TOKENS", 250))
+PRODUCTION_CAST_TOKENS = int(os.environ.get("CINEAI_PRODUCTION_CAST_TOKENS", 200))
+# Production notes only need the leads, who are cast first
+PRODUCTION_CAST_ROLES = 4
+
+def estimate_tokens(text: str) -> int:
+    # Gemini averages about four characters per token on English prose
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+_BREAK_RES = (re.compile(r'\n[ \t]*\n'), re.compile(r'\n'), re.compile(r'(?<=[.!?])\s'), re.compile(r'\s'))
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    text = text.strip()
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    head = text[:limit + 1]
+    for pattern in _BREAK_RES:
+        cut = max((match.start() for match in pattern.finditer(head)), default=0)
+        # A cleaner break isn't worth losing more than half the budget
+        if cut >= limit // 2:
+            return head[:cut].rstrip()
+    return head[:limit]
+
+def build_casting_prompt(industry: str, characters: str) -> str:
+    return f"""Suggest casting for this {industry} movie:
+
+{truncate_to_tokens(characters, CASTING_CONTEXT_TOKENS)}
+
+For each main character, suggest 2-3 {industry} actors with reasons. Consider availability and suitability."""
+
+def build_production_prompt(industry: str, premise: str, cast_summary: str) -> str:
+    return f"""Create production notes for this {industry} movie:
+
+Story: {truncate_to_tokens(premise, PRODUCTION_PREMISE_TOKENS)}
+
+Cast:
+{truncate_to_tokens(cast_summary, PRODUCTION_CAST_TOKENS)}
+
+Include: budget estimate, filming locations, director suggestions, marketing strategy."""
+
+_HEADING_RE = re.compile(r'^[ \t]*(?:(#{1,6})[ \t]+(.+?)|\*\*([^*\n]+)\*\*[ \t]*:?)[ \t]*$', re.M)
+_CHARACTER_HEADING_RE = re.compile(r'\b(?:characters?|cast)\b', re.I)
+_SECTION_HEADING_RE = re.compile(
+    r'\b(?:act|acts|plot|structure|twists?|synopsis|logline|scenes?|themes?|climax|ending|setting|outline)\b',
+    re.I
+)
+
+def extract_character_section(script: str, complete: bool = False) -> Optional[str]:
+    """Return the character section of a (possibly still streaming) script.
+
+    Returns None while the section hasn't been closed by a following heading,
+    unless ``complete`` says no more text is coming.
+    """
+    start = level = None
+    for match in _HEADING_RE.finditer(script):
+        hashes, md_title, bold_title = match.groups()
+        title = md_title or bold_title
+        # Bold-only lines rank below every markdown heading
+        heading_level = len(hashes) if hashes else 7
+
+        if start is None:
+            if _CHARACTER_HEADING_RE.search(title):
+                start, level = match.start(), heading_level
+            continue
+
+        if _CHARACTER_HEADING_RE.search(title) and heading_level > level:
+            continue
+        if heading_level <= level or _SECTION_HEADING_RE.search(title):
+            return script[start:match.start()].strip()
+
+    if start is not None and complete:
+        return script[start:].strip()
+    return None
+
+# The premise is everything before the first character or act heading:
+# script outlines open with the title, logline and synopsis
+_PREMISE_END_RE = re.compile(r'\b(?:characters?|cast|acts?|structure)\b', re.I)
+
+def extract_script_premise(script: str, complete: bool = False) -> Optional[str]:
+    """Return the opening of a (possibly still streaming) script.
+
+    Returns None until the first character or act heading has arrived,
+    unless ``complete`` says no more text is coming.
+    """
+    for match in _HEADING_RE.finditer(script):
+        if _PREMISE_END_RE.search(match.group(2) or match.group(3)):
+            return script[:match.start()].strip()
+    return script.strip() if complete else None
+
+_BULLET_RE = re.compile(r'^[ \t]*(?:[*+-]|\d+[.)])[ \t]+(.+?)[ \t]*$')
+# "Name: reason", "Name - reason", "Name (age 45) – reason"
+_PICK_END_RE = re.compile(r':|\s[-–—]\s')
+_MAX_PICK_CHARS = 60
+
+def summarize_casting(casting: str, complete: bool = False,
+                      max_roles: int = PRODUCTION_CAST_ROLES) -> Tuple[str, int]:
+    """Condense casting suggestions to one "Role: Actor, Actor" line per role.
+
+    A role is a heading (or a bullet ending in a colon) followed by bulleted
+    picks. The last role is left out while more text may still arrive, so a
+    summary of the first ``max_roles`` roles doesn't change as casting
+    streams in. Returns the summary and the number of roles in it.
+    """
+    roles = []
+    for line in casting.splitlines():
+        heading = _HEADING_RE.match(line)
+        bullet = None if heading else _BULLET_RE.match(line)
+        if heading:
+            title = heading.group(2) or heading.group(3)
+        elif bullet and bullet.group(1).rstrip('*').endswith(':'):
+            title = bullet.group(1)
+        else:
+            title = None
+        if title is not None:
+            if roles and not roles[-1][1]:
+                roles.pop()
+            if len(roles) == max_roles:
+                break
+            roles.append((title.strip('*: \t'), []))
+        elif bullet and roles:
+            pick = _PICK_END_RE.split(bullet.group(1), 1)[0].strip('* \t')
+            if pick and len(pick) <= _MAX_PICK_CHARS:
+                roles[-1][1].append(pick)
+    else:
+        if not complete and roles:
+            roles.pop()
+    roles = [(title, picks) for title, picks in roles if picks]
+    return '\n'.join(f"{title}: {', '.join(picks)}" for title, picks in roles), len(roles)
+
+# Structured output. With CINEAI_STRUCTURED_OUTPUT on (the default), casting
+# and production ask Gemini for JSON matching a response schema. Each concept
+# keeps the parsed essentials as 'cast' and 'production_details', which are
+# saved to the concept_cast / concept_production tables for SQL queries. The
+# casting and production sections are still rendered as markdown, so
+# display, search and exports work as before. A response that isn't valid
+# JSON falls back to being kept as plain text.
+STRUCTURED_OUTPUT = os.environ.get("CINEAI_STRUCTURED_OUTPUT", "1") != "0"
+
+def _schema_list(**properties) -> Dict:
+    return {"type": "ARRAY", "items": {"type": "OBJECT", "properties": properties,
+                                       "required": list(properties), "propertyOrdering": list(properties)}}
+
+CASTING_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "characters": _schema_list(
+            name={"type": "STRING"},
+            description={"type": "STRING"},
+            candidates=_schema_list(actor={"type": "STRING"}, reason={"type": "STRING"})
+        )
+    },
+    "required": ["characters"]
+}
+
+PRODUCTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "budget": {
+            "type": "OBJECT",
+            "properties": {
+                "min_usd_millions": {"type": "NUMBER", "description": "Low estimate in millions of US dollars"},
+                "max_usd_millions": {"type": "NUMBER", "description": "High estimate in millions of US dollars"},
+                "notes": {"type": "STRING"}
+            },
+            "required": ["min_usd_millions", "max_usd_millions"],
+            "propertyOrdering": ["min_usd_millions", "max_usd_millions", "notes"]
+        },
+        "locations": _schema_list(name={"type": "STRING"}, reason={"type": "STRING"}),
+        "directors": _schema_list(name={"type": "STRING"}, reason={"type": "STRING"}),
+        "marketing_strategy": {"type": "STRING"}
+    },
+    "required": ["budget", "locations", "directors", "marketing_strategy"],
+    "propertyOrdering": ["budget", "locations", "directors", "marketing_strategy"]
+}
+
+def load_structured(text: str) -> Optional[Dict]:
+    text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip())
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def parse_partial_json(text: str):
+    """Parse a JSON document that may be cut off mid-stream.
+
+    Open strings, arrays and objects are closed; a trailing value that can't
+    be completed (a dangling key, a half-written literal like ``tru``) is
+    dropped. A number cut off mid-digits parses as the digits so far, e.g.
+    "12" of an eventual 125. Returns None when nothing parseable has arrived
+    yet.
+    """
+    stack: List[str] = []
+    # (cut position, closers needed there), at points where cutting leaves valid JSON
+    cuts: List[Tuple[int, str]] = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            cuts.append((i + 1, ''.join(reversed(stack))))
+        elif ch in '}]':
+            if stack:
+                stack.pop()
+            cuts.append((i + 1, ''.join(reversed(stack))))
+        elif ch == ',':
+            cuts.append((i, ''.join(reversed(stack))))
+
+    closers = ''.join(reversed(stack))
+    head = text[:-1] if escaped else text
+    attempts = [head + ('"' if in_string else '') + closers]
+    attempts += [text[:position] + needed for position, needed in reversed(cuts[-8:])]
+    for attempt in attempts:
+        try:
+            return json.loads(attempt)
+        except ValueError:
+            continue
+    return None
+
+def _dicts(value) -> List[Dict]:
+    return [item for item in value if isinstance(item, dict)] if isinstance(value, list) else []
+
+def _text(value) -> str:
+    return value.strip() if isinstance(value, str) else ''
+
+def _number(value) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def structured_cast(data: Optional[Dict]) -> List[Dict]:
+    """[{'character': ..., 'actors': [...]}] from a casting response."""
+    cast = []
+    for character in _dicts((data or {}).get('characters')):
+        actors = [_text(candidate.get('actor')) for candidate in _dicts(character.get('candidates'))]
+        actors = [actor for actor in actors if actor]
+        if _text(character.get('name')) and actors:
+            cast.append({'character': _text(character['name']), 'actors': actors})
+    return cast
+
+def structured_production(data: Optional[Dict]) -> Dict:
+    """Budget range (millions of USD), location and director names from a production response."""
+    data = data or {}
+    budget = data.get('budget') if isinstance(data.get('budget'), dict) else {}
+    return {
+        'budget_min_musd': _number(budget.get('min_usd_millions')),
+        'budget_max_musd': _number(budget.get('max_usd_millions')),
+        'locations': [name for name in (_text(item.get('name')) for item in _dicts(data.get('locations'))) if name],
+        'directors': [name for name in (_text(item.get('name')) for item in _dicts(data.get('directors'))) if name]
+    }
+
+def summarize_cast(cast: List[Dict], max_roles: int = PRODUCTION_CAST_ROLES) -> str:
+    return '\n'.join(f"{role['character']}: {', '.join(role['actors'])}" for role in cast[:max_roles])
+
+def _render_picks(items: List[Dict], key: str) -> List[str]:
+    lines = []
+    for item in items:
+        name, reason = _text(item.get(key)), _text(item.get('reason'))
+        if name:
+            lines.append(f"- **{name}**: {reason}" if reason else f"- **{name}**")
+    return lines
+
+def render_casting(data: Dict) -> str:
+    blocks = []
+    for character in _dicts(data.get('characters')):
+        lines = [f"**{_text(character.get('name'))}**"] if _text(character.get('name')) else []
+        if _text(character.get('description')):
+            lines.append(f"_{_text(character['description'])}_")
+        lines += _render_picks(_dicts(character.get('candidates')), 'actor')
+        if lines:
+            blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+def render_production(data: Dict) -> str:
+    blocks = []
+    budget = data.get('budget') if isinstance(data.get('budget'), dict) else {}
+    low, high = _number(budget.get('min_usd_millions')), _number(budget.get('max_usd_millions'))
+    if low is not None or high is not None:
+        estimate = f"${low:g}M - ${high:g}M" if low is not None and high is not None else f"${(low if low is not None else high):g}M"
+        blocks.append('\n'.join([f"**Budget estimate:** {estimate}"] +
+                                ([_text(budget.get('notes'))] if _text(budget.get('notes')) else [])))
+    for key, heading in (('locations', "Filming locations"), ('directors', "Director suggestions")):
+        lines = _render_picks(_dicts(data.get(key)), 'name')
+        if lines:
+            blocks.append('\n'.join([f"**{heading}**"] + lines))
+    if _text(data.get('marketing_strategy')):
+        blocks.append(f"**Marketing strategy**\n{_text(data['marketing_strategy'])}")
+    return '\n\n'.join(blocks)
+
+def structure_concept_sections(outputs: Dict[str, str]) -> Dict:
+    """Markdown sections plus 'cast' / 'production_details' from JSON stage outputs.
+
+    Sections that aren't valid JSON are left out, so the caller keeps them as text.
+    """
+    structured = {}
+    casting = load_structured(outputs.get('casting', ''))
+    if casting is not None:
+        structured['casting'] = render_casting(casting)
+        structured['cast'] = structured_cast(casting)
+    production = load_structured(outputs.get('production', ''))
+    if production is not None:
+        structured['production'] = render_production(production)
+        structured['production_details'] = structured_production(production)
+    return structured
+
+STRUCTURED_STAGES = {
+    'casting': (CASTING_SCHEMA, render_casting),
+    'production': (PRODUCTION_SCHEMA, render_production)
+}
+STRUCTURED_FIELDS = {'casting': 'cast', 'production': 'production_details'}
+
+class GenerationError(Exception):
+    pass
+
+class GenerationCancelled(GenerationError):
+    pass
+
+# Hard cap on a whole concept run, so runaway generations get cut off
+GENERATION_TIMEOUT = int(os.environ.get("CINEAI_GENERATION_TIMEOUT", 300))
+
+# Concept generation pipeline
+class ConceptPipeline:
+    """Runs the script, casting and production stages concurrently.
+
+    The script is streamed; casting starts once its character section is
+    complete, and production starts once the script's premise and the first
+    PRODUCTION_CAST_ROLES roles of the casting exist. With ``structured``,
+    casting and production stream JSON (see STRUCTURED_STAGES) and
+    rendered_outputs() shows it as markdown. Industry trends are optionally
+    fetched alongside. Call cancel() from any thread to stop every stage early.
+
+    Given a ``previous`` concept, stages not listed in ``regenerate`` reuse
+    its output when their inputs are unchanged: either every stage they
+    depend on was reused too, or their prompt hashes to the stored input hash.
+    """
+
+    STAGES = ('script', 'casting', 'production')
+    STAGE_INPUTS = {'script': (), 'casting': ('script',), 'production': ('script', 'casting')}
+
+    def __init__(self, api_key: str, industry: str, genre: str, target_audience: str, runtime: int,
+                 movie_idea: str, concept_title: str, serp_api_key: Optional[str] = None,
+                 use_cache: bool = True, structured: bool = STRUCTURED_OUTPUT,
+                 previous: Optional[Dict] = None, regenerate: Iterable[str] = ()):
+        self.api_key = api_key
+        self.use_cache = use_cache
+        self.structured = structured
+        self.industry = industry
+        self.genre = genre
+        self.brief = {'industry': industry, 'genre': genre, 'target_audience': target_audience,
+                      'runtime': runtime, 'movie_idea': movie_idea, 'concept_title': concept_title}
+        self.previous = previous or {}
+        self.regenerate = set(regenerate)
+        self.reused = set()
+        self.input_hashes: Dict[str, str] = {}
+        self.serp_api_key = serp_api_key
+        self.script_prompt = build_script_prompt(industry, genre, target_audience, runtime,
+                                                 movie_idea, concept_title)
+        self.outputs = {stage: '' for stage in self.STAGES}
+        self.finished = {stage: threading.Event() for stage in self.STAGES}
+        self.started = {stage: threading.Event() for stage in self.STAGES}
+        self.characters = None
+        self.characters_ready = threading.Event()
+        self.premise = None
+        self.premise_ready = threading.Event()
+        self.cast_summary = None
+        self.cast_summary_ready = threading.Event()
+        self.trends = None
+        self.error = None
+        self.queue_positions: Dict[str, int] = {}
+        self._failed = threading.Event()
+
+    @classmethod
+    def for_regeneration(cls, api_key: str, concept_data: Dict, industry: str, sections: Iterable[str],
+                         use_cache: bool = True) -> 'ConceptPipeline':
+        """A pipeline that regenerates ``sections`` of a saved concept."""
+        brief = concept_data.get('brief')
+        if brief is None:
+            if 'script' in sections:
+                raise GenerationError("This concept was saved without its brief, so its script can't be regenerated")
+            # Concepts saved before briefs were kept always reuse their script
+            brief = {'industry': industry, 'genre': concept_data.get('genre'), 'target_audience': None,
+                     'runtime': None, 'movie_idea': None, 'concept_title': None}
+        return cls(api_key, brief['industry'], brief['genre'], brief['target_audience'], brief['runtime'],
+                   brief['movie_idea'], brief['concept_title'], use_cache=use_cache,
+                   previous=concept_data, regenerate=sections)
+
+    def cancel(self, reason: str = "Generation cancelled"):
+        if not self._failed.is_set():
+            self.error = GenerationCancelled(reason)
+            self._failed.set()
+
+    def _reusable(self, stage: str, input_hash: str) -> bool:
+        if stage in self.regenerate or self.previous.get(stage) is None:
+            return False
+        if all(upstream in self.reused for upstream in self.STAGE_INPUTS[stage]):
+            return True
+        return self.previous.get('input_hashes', {}).get(stage) == input_hash
+
+    def _stream(self, stage: str, prompt: str, on_chunk=None):
+        self.started[stage].set()
+        def on_queue(position: Optional[int]):
+            if position is None:
+                self.queue_positions.pop(stage, None)
+            else:
+                self.queue_positions[stage] = position
+
+        response_schema = STRUCTURED_STAGES[stage][0] if self._is_structured(stage) else None
+        generation_config = gemini_generation_config(response_schema)
+        input_hash = generation_cache_key(prompt, generation_config)
+        if self._reusable(stage, input_hash):
+            self.reused.add(stage)
+            self.input_hashes[stage] = self.previous.get('input_hashes', {}).get(stage, input_hash)
+            self.outputs[stage] = self.previous[stage]
+            if on_chunk:
+                on_chunk(self.outputs[stage])
+            return
+        self.input_hashes[stage] = input_hash
+
+        # A section asked to be regenerated must not come back from the generation cache
+        use_cache = self.use_cache and stage not in self.regenerate
+        for chunk in stream_gemini_api(self.api_key, prompt, cancel_event=self._failed,
+                                       use_cache=use_cache, on_queue=on_queue,
+                                       generation_config=generation_config):
+            if self._failed.is_set():
+                return
+            self.outputs[stage] += chunk
+            if on_chunk:
+                on_chunk(self.outputs[stage])
+        if not self.outputs[stage]:
+            raise GenerationError(f"Empty {stage} response from Gemini")
+
+    def _is_structured(self, stage: str) -> bool:
+        return self.structured and stage in STRUCTURED_STAGES
+
+    def rendered_outputs(self) -> Dict[str, str]:
+        """Stage outputs as displayable text, including partially streamed JSON."""
+        rendered = dict(self.outputs)
+        for stage, text in self.outputs.items():
+            if text and self._is_structured(stage):
+                data = parse_partial_json(text)
+                if isinstance(data, dict):
+                    rendered[stage] = STRUCTURED_STAGES[stage][1](data)
+        return rendered
+
+    def _wait(self, *events: threading.Event) -> bool:
+        for event in events:
+            while not event.wait(0.1):
+                if self._failed.is_set():
+                    return False
+        return not self._failed.is_set()
+
+    def _on_script_chunk(self, script: str):
+        if not self.premise_ready.is_set():
+            premise = extract_script_premise(script)
+            # Without an early heading, the head of the script has to do
+            if premise or estimate_tokens(script) > PRODUCTION_PREMISE_TOKENS:
+                self.premise = premise or script
+                self.premise_ready.set()
+        if not self.characters_ready.is_set():
+            section = extract_character_section(script)
+            if section:
+                self.characters = section
+                self.characters_ready.set()
+
+    def _run_script(self):
+        self._stream('script', self.script_prompt, self._on_script_chunk)
+        if not self.characters_ready.is_set():
+            # Fall back to the whole script when no character section stands out
+            self.characters = (extract_character_section(self.outputs['script'], complete=True)
+                               or self.outputs['script'])
+            self.characters_ready.set()
+        if not self.premise_ready.is_set():
+            self.premise = extract_script_premise(self.outputs['script'], complete=True) or self.outputs['script']
+            self.premise_ready.set()
+
+    def _on_casting_chunk(self, casting: str):
+        if self.cast_summary_ready.is_set():
+            return
+        if self.structured:
+            cast = structured_cast(parse_partial_json(casting))
+            # Until the next character has started, the last one may still be streaming
+            if len(cast) > PRODUCTION_CAST_ROLES:
+                self.cast_summary = summarize_cast(cast)
+                self.cast_summary_ready.set()
+            return
+        summary, roles = summarize_casting(casting)
+        # Casting that isn't laid out as roles and picks is passed on as is
+        if roles >= PRODUCTION_CAST_ROLES or (not roles and estimate_tokens(casting) > PRODUCTION_CAST_TOKENS):
+            self.cast_summary = summary or casting
+            self.cast_summary_ready.set()
+
+    def _run_casting(self):
+        if not self._wait(self.characters_ready):
+            return
+        self._stream('casting', build_casting_prompt(self.industry, self.characters),
+                     self._on_casting_chunk)
+        if not self.cast_summary_ready.is_set():
+            casting = self.outputs['casting']
+            if 'casting' in self.reused:
+                cast = self.previous.get('cast') or []
+            else:
+                cast = structured_cast(load_structured(casting)) if self.structured else []
+            self.cast_summary = summarize_cast(cast) or summarize_casting(casting, complete=True)[0] or casting
+            self.cast_summary_ready.set()
+
+    def _run_production(self):
+        if not self._wait(self.premise_ready, self.cast_summary_ready):
+            return
+        self._stream('production', build_production_prompt(self.industry, self.premise, self.cast_summary))
+
+    def _run_stage(self, stage: str):
+        try:
+            with timed('cineai_pipeline_stage', stage=stage):
+                getattr(self, f'_run_{stage}')()
+        except Exception as e:
+            if not self._failed.is_set():
+                self.error = e
+                self._failed.set()
+        finally:
+            self.finished[stage].set()
+
+    def progress_label(self) -> str:
+        running = [stage for stage in self.STAGES
+                   if self.started[stage].is_set() and not self.finished[stage].is_set()]
+        done = [stage for stage in self.STAGES if self.finished[stage].is_set()]
+        queued = dict(self.queue_positions)
+        if queued:
+            stage, position = min(queued.items(), key=lambda item: item[1])
+            return f"Queued for Gemini ({stage}), position {position}..."
+        label = f"Generating {', '.join(running)}..." if running else "Waiting for Gemini..."
+        return f"{label} ({len(done)}/{len(self.STAGES)} stages done)"
+
+    def run(self, on_progress=None, poll_interval: float = 0.25,
+            timeout: float = GENERATION_TIMEOUT) -> Dict:
+        deadline = time.monotonic() + timeout
+        workers = len(self.STAGES) + (1 if self.serp_api_key else 0)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            trends_future = None
+            if self.serp_api_key:
+                trends_future = executor.submit(get_trends_store().get, self.industry, self.serp_api_key)
+            for stage in self.STAGES:
+                executor.submit(self._run_stage, stage)
+
+            while not all(event.is_set() for event in self.finished.values()):
+                if time.monotonic() > deadline:
+                    self.cancel(f"Generation timed out after {timeout}s")
+                if on_progress:
+                    on_progress(self)
+                time.sleep(poll_interval)
+
+            # Never hold the concept back for the trends prefetch
+            if trends_future is not None and trends_future.done():
+                self.trends = trends_future.result()[0]
+        finally:
+            # Also reached when Streamlit interrupts the script run (Stop button,
+            # navigation): make sure no stage keeps streaming in the background
+            if not all(event.is_set() for event in self.finished.values()):
+                self.cancel()
+            executor.shutdown(wait=False)
+
+        if isinstance(self.error, GenerationError):
+            raise self.error
+        if self.error:
+            raise GenerationError(str(self.error)) from self.error
+
+        concept_data = {
+            'script': self.outputs['script'],
+            'casting': self.outputs['casting'],
+            'production': self.outputs['production'],
+            'genre': self.genre,
+            'input_hashes': dict(self.input_hashes),
+            'timestamp': datetime.now().isoformat()
+        }
+        if self.structured:
+            concept_data.update(structure_concept_sections(
+                {stage: text for stage, text in self.outputs.items() if stage not in self.reused}
+            ))
+        for stage in self.reused:
+            for field in (stage, STRUCTURED_FIELDS.get(stage)):
+                if field in self.previous:
+                    concept_data[field] = self.previous[field]
+        brief = self.previous.get('brief') if self.previous else self.brief
+        if brief:
+            concept_data['brief'] = brief
+        return concept_data
+
+# Regenerated versions are saved as new concepts (see save_concept_version)
+# titled after the original with a " (vN)" suffix
+_VERSION_SUFFIX_RE = re.compile(r' \(v\d+\)$')
+
+def versioned_title(title: str, version: int) -> str:
+    return f"{_VERSION_SUFFIX_RE.sub('', title)} (v{version})"
+
+# Batch generation: one idea expanded into variants (genre x audience x
+# runtime), each run through its own ConceptPipeline on a bounded pool.
+# Results are collected rather than saved, so callers can write them all with
+# save_movie_concepts in a single transaction.
+BATCH_MAX_WORKERS = int(os.environ.get("CINEAI_BATCH_MAX_WORKERS", 3))
+BATCH_MAX_VARIANTS = int(os.environ.get("CINEAI_BATCH_MAX_VARIANTS", 48))
+
+def expand_concept_variants(base: Dict, genres: List[str], audiences: List[str],
+                            runtimes: List[int]) -> List[Dict]:
+    """Concept params for every genre/audience/runtime combination of ``base``."""
+    variants = []
+    for genre in genres:
+        for target_audience in audiences:
+            for runtime in runtimes:
+                variants.append(dict(
+                    base, genre=genre, target_audience=target_audience, runtime=runtime,
+                    concept_title=f"{base['concept_title']} ({genre}, {target_audience}, {runtime} min)"
+                ))
+    return variants
+
+class ConceptBatch:
+    def __init__(self, api_key: str, variants: List[Dict], max_workers: int = BATCH_MAX_WORKERS,
+                 use_cache: bool = True):
+        if len(variants) > BATCH_MAX_VARIANTS:
+            raise GenerationError(f"A batch is limited to {BATCH_MAX_VARIANTS} variants")
+        self.api_key = api_key
+        self.variants = variants
+        self.max_workers = max(1, min(max_workers, len(variants) or 1))
+        self.use_cache = use_cache
+        self.results: List[Optional[Dict]] = [None] * len(variants)
+        self._running: Dict[int, ConceptPipeline] = {}
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._cancel_reason = "Generation cancelled"
+
+    def cancel(self, reason: str = "Generation cancelled"):
+        if not self._cancelled.is_set():
+            self._cancel_reason = reason
+        self._cancelled.set()
+        with self._lock:
+            running = list(self._running.values())
+        for pipeline in running:
+            pipeline.cancel(reason)
+
+    def rendered_outputs(self) -> Dict[str, str]:
+        # Duck-types ConceptPipeline for job progress reporting; a batch has no live text
+        return {}
+
+    def progress_label(self) -> str:
+        done = sum(1 for result in self.results if result is not None)
+        with self._lock:
+            running = len(self._running)
+        return f"Generating variants: {done}/{len(self.variants)} done, {running} in progress..."
+
+    def _run_variant(self, index: int):
+        params = self.variants[index]
+        if self._cancelled.is_set():
+            self.results[index] = {'params': params, 'error': self._cancel_reason}
+            return
+        pipeline = ConceptPipeline(self.api_key, params['industry'], params['genre'], params['target_audience'],
+                                   params['runtime'], params['movie_idea'], params['concept_title'],
+                                   use_cache=params.get('use_cache', self.use_cache))
+        with self._lock:
+            self._running[index] = pipeline
+        try:
+            self.results[index] = {'params': params, 'concept_data': pipeline.run()}
+        except Exception as e:
+            self.results[index] = {'params': params, 'error': str(e)}
+        finally:
+            with self._lock:
+                self._running.pop(index, None)
+
+    def run(self, on_progress=None, poll_interval: float = 0.25) -> List[Dict]:
+        """Generate every variant; returns one dict per variant, in order, with
+        either ``concept_data`` or ``error``."""
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = [executor.submit(self._run_variant, i) for i in range(len(self.variants))]
+            while not all(future.done() for future in futures):
+                if on_progress:
+                    on_progress(self)
+                time.sleep(poll_interval)
+        finally:
+            if not all(result is not None for result in self.results):
+                self.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if self._cancelled.is_set():
+            raise GenerationCancelled(self._cancel_reason)
+        return self.results
+
+def save_batch_results(user_id, results: List[Dict]) -> List[int]:
+    """Bulk-save the successful results of ConceptBatch.run, in order."""
+    return save_movie_concepts(user_id, [
+        (result['params']['concept_title'], result['params']['industry'], result['concept_data'])
+        for result in results if 'concept_data' in result
+    ])
+
+# Background generation jobs. Submitting a concept only inserts a queued row
+# in generation_jobs; a dispatcher thread in each app process claims queued
+# jobs for a bounded worker pool, which runs the pipeline, persists per-stage
+# progress (doubling as a heartbeat) and saves the result with
+# save_movie_concept. Sessions poll or resume jobs by id, so generation
+# survives reruns, navigation and disconnects. Jobs whose heartbeat stops
+# (e.g. their process died) are put back in the queue. A job whose params
+# hold a list of ``variants`` runs them as a ConceptBatch instead; one with
+# ``regenerate`` sections saves a new version of ``concept_id``.
+GENERATION_MAX_WORKERS = int(os.environ.get("CINEAI_GENERATION_MAX_WORKERS", 4))
+JOB_PROGRESS_INTERVAL = 1.0
+JOB_POLL_INTERVAL = 1.0
+JOB_STALE_AFTER = int(os.environ.get("CINEAI_JOB_STALE_AFTER", 120))
+ACTIVE_JOB_STATUSES = ('queued', 'running', 'cancelling')
+
+def _job_row_to_dict(row) -> Dict:
+    keys = ('id', 'user_id', 'status', 'params', 'progress', 'worker_id',
+            'concept_id', 'error', 'created_at', 'updated_at')
+    job = dict(zip(keys, row))
+    job['params'] = json.loads(job['params'])
+    job['progress'] = json.loads(job['progress']) if job['progress'] else {}
+    return job
+
+_JOB_COLUMNS = ("id, user_id, status, params, progress, worker_id, concept_id, error, "
+                "created_at, updated_at")
+
+def submit_generation_job(user_id, params: Dict) -> str:
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with db_connection() as conn:
+        conn.execute(
+            "INSERT INTO generation_jobs (id, user_id, status, params, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, user_id, json.dumps(params), now, now)
+        )
+    get_job_manager().notify()
+    return job_id
+
+def get_generation_job(job_id: str) -> Optional[Dict]:
+    with db_connection() as conn:
+        row = conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM generation_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    return _job_row_to_dict(row) if row else None
+
+def get_active_generation_job(user_id) -> Optional[Dict]:
+    with db_connection() as conn:
+        row = conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM generation_jobs "
+            f"WHERE user_id = ? AND status IN ({', '.join('?' * len(ACTIVE_JOB_STATUSES))}) "
+            "ORDER BY created_at DESC LIMIT 1",
+            (user_id, *ACTIVE_JOB_STATUSES)
+        ).fetchone()
+    return _job_row_to_dict(row) if row else None
+
+def get_job_queue_position(job: Dict) -> int:
+    with db_connection() as conn:
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM generation_jobs WHERE status = 'queued' AND created_at < ?",
+            (job['created_at'],)
+        ).fetchone()[0]
+    return ahead + 1
+
+def cancel_generation_job(job_id: str):
+    now = time.time()
+    with db_connection() as conn:
+        conn.execute(
+            "UPDATE generation_jobs SET status = 'cancelled', error = 'Generation cancelled', updated_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (now, job_id)
+        )
+        conn.execute(
+            "UPDATE generation_jobs SET status = 'cancelling', updated_at = ? "
+            "WHERE id = ? AND status = 'running'",
+            (now, job_id)
+        )
+
+class GenerationJobManager:
+    def __init__(self, max_workers: int = GENERATION_MAX_WORKERS):
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation-job")
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._dispatcher = None
+
+    def start(self):
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="generation-dispatcher",
+                                                daemon=True)
+            self._dispatcher.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _requeue_stale_jobs(self):
+        cutoff = time.time() - JOB_STALE_AFTER
+        with db_connection() as conn:
+            conn.execute(
+                "UPDATE generation_jobs SET status = 'queued', worker_id = NULL, updated_at = ? "
+                "WHERE status = 'running' AND updated_at < ?",
+                (time.time(), cutoff)
+            )
+            conn.execute(
+                "UPDATE generation_jobs SET status = 'cancelled', error = 'Generation cancelled', "
+                "updated_at = ? WHERE status = 'cancelling' AND updated_at < ?",
+                (time.time(), cutoff)
+            )
 
-def save_user_api_keys(user_id, gemini_key, serp_key):
-    conn = sqlite3.connect('movie_agent.db')
-    c = conn.cursor()
-    c.execute(
-        "UPDATE users SET gemini_api_key = ?, serp_api_key = ? WHERE id = ?",
-        (gemini_key, serp_key, user_id)
-    )
-    conn.commit()
-    conn.close()
+    def _claim_next(self) -> Optional[Dict]:
+        with db_connection() as conn:
+            while True:
+                row = conn.execute(
+                    f"SELECT {_JOB_COLUMNS} FROM generation_jobs WHERE status = 'queued' "
+                    "ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                claimed = conn.execute(
+                    "UPDATE generation_jobs SET status = 'running', worker_id = ?, updated_at = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (self.worker_id, time.time(), row[0])
+                ).rowcount
+                conn.commit()
+                # Another process may have claimed it first
+                if claimed:
+                    job = _job_row_to_dict(row)
+                    job['status'] = 'running'
+                    return job
 
-def save_movie_concept(user_id, title, industry, concept_data):
-    conn = sqlite3.connect('movie_agent.db')
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO movie_concepts (user_id, title, industry, concept_data) VALUES (?, ?, ?, ?)",
-        (user_id, title, industry, json.dumps(concept_data))
-    )
-    conn.commit()
-    conn.close()
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            try:
+                self._requeue_stale_jobs()
+                while self._slots.acquire(blocking=False):
+                    job = self._claim_next()
+                    if job is None:
+                        self._slots.release()
+                        break
+                    self._executor.submit(self._run_job, job)
+            except sqlite3.Error:
+                pass
+            self._wakeup.wait(JOB_POLL_INTERVAL)
+            self._wakeup.clear()
 
-def get_user_concepts(user_id):
-    conn = sqlite3.connect('movie_agent.db')
-    c = conn.cursor()
-    c.execute(
-        "SELECT id, title, industry, created_at FROM movie_concepts WHERE user_id = ? ORDER BY created_at DESC",
-        (user_id,)
-    )
-    concepts = c.fetchall()
-    conn.close()
-    return concepts
+    def _report_progress(self, job_id: str, pipeline: ConceptPipeline):
+        progress = dict(pipeline.rendered_outputs(), label=pipeline.progress_label())
+        with db_connection() as conn:
+            conn.execute(
+                "UPDATE generation_jobs SET progress = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(progress), time.time(), job_id)
+            )
+            status = conn.execute("SELECT status FROM generation_jobs WHERE id = ?", (job_id,)).fetchone()
+        if status and status[0] == 'cancelling':
+            pipeline.cancel()
 
-def get_concept_details(concept_id):
-    conn = sqlite3.connect('movie_agent.db')
-    c = conn.cursor()
-    c.execute(
-        "SELECT concept_data FROM movie_concepts WHERE id = ?",
-        (concept_id,)
-    )
-    concept = c.fetchone()
-    conn.close()
-    return json.loads(concept[0]) if concept else None
+    def _finish(self, job: Dict, status: str, concept_id=None, error=None, progress: Optional[Dict] = None):
+        now = time.time()
+        with db_connection() as conn:
+            conn.execute(
+                "UPDATE generation_jobs SET status = ?, concept_id = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, concept_id, error, now, job['id'])
+            )
+            if progress is not None:
+                conn.execute("UPDATE generation_jobs SET progress = ? WHERE id = ?",
+                             (json.dumps(progress), job['id']))
+        # Submission to completion, including time spent queued
+        get_metrics().observe("cineai_job_seconds", now - job['created_at'], status=status)
 
-# Initialize session state
-if 'user_id' not in st.session_state:
-    st.session_state.user_id = None
-if 'username' not in st.session_state:
-    st.session_state.username = None
-if 'concept_data' not in st.session_state:
-    st.session_state.concept_data = None
-if 'page' not in st.session_state:
-    st.session_state.page = 'login'
-if 'industry_trends' not in st.session_state:
-    st.session_state.industry_trends = {}
+    def _run_job(self, job: Dict):
+        job_id, params = job['id'], job['params']
+        try:
+            gemini_api_key, serp_api_key = load_user_api_keys(job['user_id'])
+            if not gemini_api_key:
+                raise GenerationError("No Gemini API key configured")
 
-# Improved Gemini API call
-def call_gemini_api(api_key: str, prompt: str) -> Optional[str]:
-    try:
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-        headers = {
-            'Content-Type': 'application/json',
-            'X-goog-api-key': api_key
-        }
-        data = {
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {
-                "temperature": 0.8,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 4096
-            }
-        }
-        
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        
-        result = response.json()
-        if result.get('candidates') and result['candidates'][0].get('content'):
-            return result['candidates'][0]['content']['parts'][0]['text']
-        
-        return None
-        
-    except Exception as e:
-        st.error(f"❌ Gemini API Error: {str(e)}")
-        return None
+            if params.get('variants'):
+                self._run_batch_job(job, gemini_api_key)
+                return
 
-# Improved actor name extraction
-def extract_actor_names(text: str) -> List[str]:
-    patterns = [
-        r'\b([A-Z][a-z]+ [A-Z][a-z]+)\b',
-        r'[-•*]\s+([A-Z][a-z]+ [A-Z][a-z]+)',
-        r'\*\*([A-Z][a-z]+ [A-Z][a-z]+)\*\*',
-        r'([A-Z][a-z]+ [A-Z][a-z]+)(?=\s*[:,-])'
-    ]
-    
-    actors = set()
-    for pattern in patterns:
-        found_actors = re.findall(pattern, text)
-        actors.update(found_actors)
-    
-    false_positives = {'Diversity Considerations', 'Potential Chemistry', 'Current Availability', 
-                      'Box Office', 'Market Research', 'Social Media', 'Recent Projects'}
-    actors = [actor for actor in actors if actor not in false_positives and len(actor.split()) >= 2]
-    
-    return list(actors)[:6]
+            if params.get('regenerate'):
+                if get_concept_owner(params['concept_id']) != job['user_id']:
+                    raise GenerationError("Concept not found")
+                pipeline = ConceptPipeline.for_regeneration(gemini_api_key, get_concept_details(params['concept_id']),
+                                                            params['industry'], params['regenerate'],
+                                                            use_cache=params.get('use_cache', True))
+            else:
+                # Only prefetch trends alongside generation when the shared store is still cold
+                trends_api_key = None
+                if serp_api_key and get_trends_store().peek(params['industry']) is None:
+                    trends_api_key = serp_api_key
+                pipeline = ConceptPipeline(gemini_api_key, params['industry'], params['genre'],
+                                           params['target_audience'], params['runtime'], params['movie_idea'],
+                                           params['concept_title'], serp_api_key=trends_api_key,
+                                           use_cache=params.get('use_cache', True))
 
-# Real actor research with SerpAPI
-def search_actor_info(actor_name: str, api_key: str, industry: str) -> Dict:
-    try:
-        if industry == "Bollywood":
-            search_query = f"{actor_name} Bollywood actor latest movies 2024 new projects filmography"
-        else:
-            search_query = f"{actor_name} Hollywood actor latest movies 2024 new projects filmography"
-        
-        params = {
-            'q': search_query,
-            'api_key': api_key,
-            'engine': 'google',
-            'num': 8
-        }
-        
-        response = requests.get('https://serpapi.com/search', params=params, timeout=20)
-        response.raise_for_status()
-        data = response.json()
-        
-        actor_info = {
-            'name': actor_name,
-            'latest_projects': [],
-            'news': [],
-            'status': 'Active'
-        }
-        
-        # Process organic results
-        organic_results = data.get('organic_results', [])
-        for result in organic_results[:5]:
-            if any(keyword in result.get('title', '').lower() for keyword in ['movie', 'film', 'series', 'project']):
-                actor_info['latest_projects'].append({
-                    'title': result.get('title', ''),
-                    'description': result.get('snippet', ''),
-                    'link': result.get('link', '')
-                })
-        
-        # Process news results if available
-        news_results = data.get('news_results', [])
-        for news in news_results[:3]:
-            actor_info['news'].append({
-                'title': news.get('title', ''),
-                'summary': news.get('snippet', ''),
-                'source': news.get('source', ''),
-                'date': news.get('date', ''),
-                'link': news.get('link', '')
-            })
-        
-        return actor_info
-        
-    except Exception as e:
-        return {'name': actor_name, 'error': f"Research failed: {str(e)}"}
+            last_report = [0.0]
+            def on_progress(p: ConceptPipeline):
+                if time.monotonic() - last_report[0] >= JOB_PROGRESS_INTERVAL:
+                    last_report[0] = time.monotonic()
+                    self._report_progress(job_id, p)
 
-# Real industry trends research
-def get_industry_trends(api_key: str, industry: str) -> Dict:
-    try:
-        if industry == "Bollywood":
-            search_query = "Bollywood 2024 box office hits trends new movies Indian cinema industry news"
+            concept_data = pipeline.run(on_progress=on_progress)
+            if params.get('regenerate'):
+                concept_id, _ = save_concept_version(job['user_id'], params['concept_title'], params['industry'],
+                                                     concept_data, params['concept_id'])
+            else:
+                concept_id = save_movie_concept(job['user_id'], params['concept_title'], params['industry'],
+                                                concept_data)
+            self._finish(job, 'done', concept_id=concept_id)
+        except GenerationCancelled as e:
+            self._finish(job, 'cancelled', error=str(e))
+        except Exception as e:
+            self._finish(job, 'failed', error=str(e))
+        finally:
+            self._slots.release()
+            self.notify()
+
+    def _run_batch_job(self, job: Dict, gemini_api_key: str):
+        batch = ConceptBatch(gemini_api_key, job['params']['variants'],
+                             use_cache=job['params'].get('use_cache', True))
+        last_report = [0.0]
+        def on_progress(b: ConceptBatch):
+            if time.monotonic() - last_report[0] >= JOB_PROGRESS_INTERVAL:
+                last_report[0] = time.monotonic()
+                self._report_progress(job['id'], b)
+
+        results = batch.run(on_progress=on_progress)
+        concept_ids = iter(save_batch_results(job['user_id'], results))
+        summary = [
+            {'title': result['params']['concept_title'], 'concept_id': next(concept_ids)}
+            if 'concept_data' in result else
+            {'title': result['params']['concept_title'], 'error': result['error']}
+            for result in results
+        ]
+        failed = [item for item in summary if 'error' in item]
+        if len(failed) == len(summary):
+            self._finish(job, 'failed', error=failed[0]['error'], progress={'batch': summary})
         else:
-            search_query = "Hollywood 2024 box office hits trends new movies industry news"
-        
-        params = {
-            'q': search_query,
-            'api_key': api_key,
-            'engine': 'google',
-            'num': 10,
-            'tbm': 'nws'
-        }
-        
-        response = requests.get('https://serpapi.com/search', params=params, timeout=20)
-        response.raise_for_status()
-        data = response.json()
-        
-        trends = {
-            'latest_news': [],
-            'market_trends': [],
-            'successful_films': []
-        }
-        
-        # Process news results
-        news_results = data.get('news_results', [])
-        for news in news_results[:6]:
-            trends['latest_news'].append({
-                'title': news.get('title', ''),
-                'summary': news.get('snippet', ''),
-                'source': news.get('source', ''),
-                'date': news.get('date', ''),
-                'link': news.get('link', '')
-            })
-        
-        return trends
-        
-    except Exception as e:
-        return {'error': f"Trends research failed: {str(e)}"}
+            self._finish(job, 'done', progress={'batch': summary})
+
+@st.cache_resource
+def get_job_manager() -> GenerationJobManager:
+    manager = GenerationJobManager()
+    manager.start()
+    return manager
 
 # Authentication Pages
 def login_page():
@@ -446,6 +3643,19 @@ def main_app():
     elif st.session_state.page == 'saved':
         show_saved_concepts()
 
+def show_timing_panel(spans: List[Tuple[str, Dict, float]]):
+    """Admin-only breakdown of where the current rerun spent its time."""
+    totals: Dict[str, List] = {}
+    for name, labels, elapsed in spans:
+        label = name + ''.join(f" {k}={v}" for k, v in sorted(labels.items()))
+        entry = totals.setdefault(label, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+    with st.sidebar:
+        with st.expander("⏱️ Rerun timings"):
+            for label, (count, elapsed) in sorted(totals.items(), key=lambda item: -item[1][1]):
+                st.caption(f"{label}: {elapsed * 1000:.1f} ms" + (f" ({count} calls)" if count > 1 else ""))
+
 def show_settings_page():
     st.header("⚙️ API Settings")
     gemini_api_key, serp_api_key = get_user_api_keys(st.session_state.user_id)
@@ -462,27 +3672,289 @@ def show_settings_page():
             save_user_api_keys(st.session_state.user_id, new_gemini_key, new_serp_key)
             st.success("API keys saved successfully!")
 
+CONCEPT_PAGE_SIZES = [10, 25, 50, 100]
+
+def reset_concept_pages():
+    st.session_state.concept_cursors = [None]
+
+def reset_search_pages():
+    st.session_state.concept_search_offset = 0
+
+def render_saved_concept(concept_id, title, industry, created_at, snippet=None):
+    # FIXED: Remove unsafe_allow_html parameter from expander
+    with st.expander(f"{title} - {industry} - {created_at.split()[0]}"):
+        industry_class = "hollywood" if industry == "Hollywood" else "bollywood"
+        st.markdown(f"<span class='industry-tag {industry_class}'>{industry}</span>", unsafe_allow_html=True)
+        st.write(f"Created: {created_at}")
+        if snippet:
+            st.markdown(f"> {snippet}")
+        
+        if st.button("Load Concept", key=f"load_{concept_id}"):
+            concept_data = get_concept_details(concept_id)
+            if concept_data:
+                set_current_concept(concept_data, title, industry, concept_id)
+                st.rerun()
+
+        if st.checkbox("🔗 Show similar concepts", key=f"similar_{concept_id}"):
+            similar = similar_concepts(st.session_state.user_id, concept_id)
+            if not similar:
+                st.caption("No similar concepts yet.")
+            for _, similar_title, similar_industry, similar_created_at, score in similar:
+                st.caption(f"{similar_title} - {similar_industry} - {similar_created_at.split()[0]} "
+                           f"({score:.0%} match)")
+
+def show_backup_panel():
+    with st.expander("💾 Backup & restore"):
+        st.caption("Backups are gzipped JSON lines, one concept per line. "
+                   "Restoring skips concepts you already have.")
+        # Deferred: the export runs off the script thread when the download is
+        # clicked, writing to a temp file rather than building the archive in memory.
+        # Very large libraries are better exported with `python cli.py export`.
+        user_id = st.session_state.user_id
+        st.download_button("📥 Download backup", lambda: export_backup_file(user_id),
+                           file_name=f"cineai_{st.session_state.username}_{datetime.now():%Y%m%d}.jsonl.gz",
+                           mime="application/gzip")
+
+        archive = st.file_uploader("Restore from backup", type=["gz", "jsonl"])
+        if archive is not None and st.button("Import concepts"):
+            lines = gzip.GzipFile(fileobj=archive) if archive.name.endswith('.gz') else archive
+            try:
+                counts = import_concepts(lines, st.session_state.user_id)
+            except (OSError, EOFError) as e:
+                st.error(f"❌ Could not read backup: {e}")
+                return
+            reset_concept_pages()
+            st.success(f"Imported {counts['imported']} concepts ({counts['skipped']} already saved).")
+            if counts['invalid']:
+                st.warning(f"⚠️ Skipped {counts['invalid']} unreadable lines.")
+
 def show_saved_concepts():
     st.header("📚 My Saved Concepts")
-    concepts = get_user_concepts(st.session_state.user_id)
+    show_backup_panel()
+    show_budget_stats()
+    show_concept_library()
+
+def show_budget_stats():
+    rows = get_budget_by_genre(st.session_state.user_id)
+    if not rows:
+        return
+    with st.expander("📊 Budgets by genre"):
+        st.table([{
+            'Genre': genre,
+            'Concepts': count,
+            'Average budget': f"${low:,.0f}M - ${high:,.0f}M" if low is not None and high is not None else "-"
+        } for genre, count, low, high in rows])
+
+# Searching, paging and per-concept toggles only rerun the library fragment
+@st.fragment
+@instrumented('cineai_fragment', fragment='library')
+def show_concept_library():
+    if 'concept_cursors' not in st.session_state:
+        reset_concept_pages()
+    if 'concept_search_offset' not in st.session_state:
+        reset_search_pages()
+
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        search_text = st.text_input("🔍 Search concepts", key="concept_search",
+                                    placeholder="Title, characters, actors, locations...",
+                                    on_change=reset_search_pages)
+    with col2:
+        page_size = st.selectbox("Concepts per page", CONCEPT_PAGE_SIZES, key="concept_page_size",
+                                 on_change=reset_concept_pages)
+
+    if search_text.strip():
+        show_concept_search_results(search_text, page_size)
+        return
+
+    cursors = st.session_state.concept_cursors
+    concepts, next_cursor = get_user_concepts_page(st.session_state.user_id, page_size, cursors[-1])
     
     if not concepts:
+        if len(cursors) > 1:
+            reset_concept_pages()
+            st.rerun(scope="fragment")
         st.info("You haven't saved any movie concepts yet.")
         return
     
     for concept_id, title, industry, created_at in concepts:
-        # FIXED: Remove unsafe_allow_html parameter from expander
-        with st.expander(f"{title} - {industry} - {created_at.split()[0]}"):
-            industry_class = "hollywood" if industry == "Hollywood" else "bollywood"
-            st.markdown(f"<span class='industry-tag {industry_class}'>{industry}</span>", unsafe_allow_html=True)
-            st.write(f"Created: {created_at}")
-            
-            if st.button("Load Concept", key=f"load_{concept_id}"):
-                concept_data = get_concept_details(concept_id)
-                if concept_data:
-                    st.session_state.concept_data = concept_data
-                    st.rerun()
+        render_saved_concept(concept_id, title, industry, created_at)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("◀ Newer", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun(scope="fragment")
+    with col2:
+        st.caption(f"Page {len(cursors)}")
+    with col3:
+        if st.button("Older ▶", disabled=next_cursor is None, use_container_width=True):
+            cursors.append(next_cursor)
+            st.rerun(scope="fragment")
+
+def show_concept_search_results(search_text, page_size):
+    offset = st.session_state.concept_search_offset
+    results, has_more = search_user_concepts(st.session_state.user_id, search_text, page_size, offset)
+
+    if not results:
+        st.info("No saved concepts match your search.")
+        return
+
+    for concept_id, title, industry, created_at, snippet in results:
+        render_saved_concept(concept_id, title, industry, created_at, snippet)
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("◀ Previous", disabled=offset == 0, use_container_width=True):
+            st.session_state.concept_search_offset = max(0, offset - page_size)
+            st.rerun(scope="fragment")
+    with col2:
+        st.caption(f"Results {offset + 1}-{offset + len(results)}")
+    with col3:
+        if st.button("Next ▶", disabled=not has_more, use_container_width=True):
+            st.session_state.concept_search_offset = offset + page_size
+            st.rerun(scope="fragment")
+
+SECTION_HEADINGS = {
+    'script': "📜 Script Outline",
+    'casting': "🎭 Casting Suggestions",
+    'production': "💼 Production Notes"
+}
+
+def concept_fingerprint(concept_data: Dict) -> str:
+    digest = hashlib.sha1()
+    for section in CONCEPT_SECTIONS + ('timestamp',):
+        digest.update(str(concept_data.get(section, '')).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def build_concept_text(concept_title: str, industry: str, data: Dict) -> str:
+    return f"""MOVIE CONCEPT: {concept_title}
+Industry: {industry}
+Generated: {data['timestamp']}
+
+SCRIPT:
+{data['script']}
+
+CASTING:
+{data['casting']}
+
+PRODUCTION:
+{data['production']}"""
+
+def render_actor_info(actor_info: Dict):
+    if 'error' in actor_info:
+        st.error(actor_info['error'])
+        return
+    if actor_info['latest_projects']:
+        st.write("**Latest Projects:**")
+        for project in actor_info['latest_projects'][:3]:
+            st.write(f"- {project['title']}")
+            if project['description']:
+                st.caption(project['description'])
+    if actor_info['news']:
+        st.write("**Recent News:**")
+        for news in actor_info['news'][:2]:
+            st.write(f"- {news['title']}")
+            st.caption(f"{news['source']} - {news.get('date', 'Recent')}")
+
+def show_generation_job(job_id: str):
+    # Clicking Stop reruns the creator; the job itself keeps running in the
+    # worker pool until it notices the cancellation
+    if st.button("⏹ Stop generation", key="stop_generation"):
+        cancel_generation_job(job_id)
+    show_job_progress(job_id)
+
+# One snapshot of the job per run; Streamlit reruns just this fragment every
+# JOB_POLL_INTERVAL instead of a script thread sleeping until the job ends
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+@instrumented('cineai_fragment', fragment='job_progress')
+def show_job_progress(job_id: str):
+    job = get_generation_job(job_id)
+    if job is None or job['status'] not in ACTIVE_JOB_STATUSES:
+        # A full rerun drops this fragment (and its timer) and shows the outcome
+        st.session_state.active_job_id = None
+        st.session_state.finished_job_id = job_id
+        st.rerun()
+
+    if job['status'] == 'queued':
+        label = f"Queued for a generation worker, position {get_job_queue_position(job)}..."
+    elif job['status'] == 'cancelling':
+        label = "Stopping generation..."
+    else:
+        label = job['progress'].get('label', "Creating your movie concept...")
+    st.status(label, expanded=False)
+    # Batches only report counts, there is no single concept to stream
+    if not job['params'].get('variants'):
+        for stage, heading in SECTION_HEADINGS.items():
+            st.subheader(heading)
+            st.markdown(job['progress'].get(stage, ''))
+
+def show_job_outcome(job_id: str):
+    job = get_generation_job(job_id)
+    if job is None:
+        st.status("Generation job not found", state="error")
+    elif 'batch' in job['progress']:
+        show_batch_summary(job, st.status("Variants generated", expanded=False))
+    elif job['status'] == 'done':
+        st.status("Concept generated", state="complete")
+        concept_data = get_concept_details(job['concept_id'])
+        title = job['params']['concept_title']
+        if job['params'].get('regenerate'):
+            title = versioned_title(title, concept_data['version'])
+            st.session_state.generation_notice = f"Regenerated and saved as {title}!"
+        else:
+            st.session_state.generation_notice = "Concept generated successfully!"
+        # Outcomes are shown in a full run, so the results area below picks this up
+        set_current_concept(concept_data, title, job['params']['industry'], job['concept_id'])
+    elif job['status'] == 'cancelled':
+        st.status("Concept generation stopped", state="error")
+        st.warning(f"⏹ {job['error'] or 'Generation cancelled'}")
+    else:
+        st.status("Concept generation failed", state="error")
+        st.error(f"❌ Gemini API Error: {job['error']}")
+
+def show_batch_summary(job: Dict, status):
+    summary = job['progress']['batch']
+    failed = [item for item in summary if 'error' in item]
+    if job['status'] == 'done':
+        status.update(label="Variants generated", state="complete")
+        st.success(f"Generated {len(summary) - len(failed)} of {len(summary)} variants. "
+                   "Find them under My Saved Concepts.")
+    else:
+        status.update(label="Variant generation failed", state="error")
+    for item in failed:
+        st.warning(f"⚠️ {item['title']}: {item['error']}")
+
+def show_similar_idea_prompt(pending: Dict):
+    st.info("💡 You already have concepts similar to this idea. Open one instead of spending a new generation?")
+    for concept_id, title, industry, created_at, score in pending['matches']:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.write(f"**{title}** - {industry} - {created_at.split()[0]} ({score:.0%} match)")
+        with col2:
+            if st.button("Open", key=f"open_similar_{concept_id}", use_container_width=True):
+                set_current_concept(get_concept_details(concept_id), title, industry, concept_id)
+                st.session_state.pending_generation = None
+                st.rerun()
+    if st.button("🚀 Generate anyway"):
+        st.session_state.active_job_id = submit_generation_job(st.session_state.user_id, pending['params'])
+        st.session_state.pending_generation = None
+        st.rerun(scope="fragment")
+
+GENRE_OPTIONS = ["Action", "Comedy", "Drama", "Sci-Fi", "Horror", "Romance", "Thriller"]
+AUDIENCE_OPTIONS = ["General", "Teenagers", "Adults", "Family"]
+BATCH_RUNTIME_OPTIONS = [90, 105, 120, 135, 150]
 
+def set_current_concept(concept_data: Optional[Dict], title: str, industry: str, concept_id=None):
+    st.session_state.concept_data = concept_data
+    st.session_state.concept_info = {'title': title, 'industry': industry, 'concept_id': concept_id}
+
+# The create page is split into fragments so that a click only reruns the
+# region it belongs to: editing the form never re-renders the results, and
+# toggling an actor only researches that actor. Anything that changes
+# another region (a finished generation, opening a saved concept) asks for a
+# full rerun with st.rerun().
 def show_main_content(gemini_api_key, serp_api_key):
     st.header("🎬 Create Movie Concept")
     
@@ -490,25 +3962,38 @@ def show_main_content(gemini_api_key, serp_api_key):
         st.error("⚠️ Please set your Gemini API key in Settings to generate concepts")
         return
     
+    show_concept_creator(serp_api_key)
+    show_concept_results(serp_api_key)
+
+@st.fragment
+@instrumented('cineai_fragment', fragment='trends')
+def show_trends_panel(industry: str, serp_api_key: str):
+    with st.expander("📈 Live Industry Trends", expanded=True):
+        trends_store = get_trends_store()
+        if trends_store.peek(industry) is None:
+            with st.spinner("🔄 Fetching real-time trends..."):
+                trends, fetched_at = trends_store.get(industry, serp_api_key)
+        else:
+            trends, fetched_at = trends_store.get(industry, serp_api_key)
+        
+        if 'error' in trends:
+            st.error(trends['error'])
+        else:
+            st.caption(f"Last updated: {datetime.fromtimestamp(fetched_at).strftime('%Y-%m-%d %H:%M')}")
+            for news in trends.get('latest_news', [])[:3]:
+                st.markdown(f"**{news['title']}**")
+                st.caption(f"{news['source']} - {news.get('date', 'Recent')}")
+                st.write(news['summary'])
+                st.markdown("---")
+
+@st.fragment
+@instrumented('cineai_fragment', fragment='creator')
+def show_concept_creator(serp_api_key):
     industry = st.radio("Select Industry:", ["Hollywood", "Bollywood"], horizontal=True)
     
     # Real-time trends
     if serp_api_key:
-        with st.expander("📈 Live Industry Trends", expanded=True):
-            if industry not in st.session_state.industry_trends:
-                with st.spinner("🔄 Fetching real-time trends..."):
-                    trends_data = get_industry_trends(serp_api_key, industry)
-                    st.session_state.industry_trends[industry] = trends_data
-            
-            trends = st.session_state.industry_trends[industry]
-            if 'error' in trends:
-                st.error(trends['error'])
-            else:
-                for news in trends.get('latest_news', [])[:3]:
-                    st.markdown(f"**{news['title']}**")
-                    st.caption(f"{news['source']} - {news.get('date', 'Recent')}")
-                    st.write(news['summary'])
-                    st.markdown("---")
+        show_trends_panel(industry, serp_api_key)
     
     # Concept input
     movie_idea = st.text_area("Movie Idea:", height=100,
@@ -516,128 +4001,167 @@ def show_main_content(gemini_api_key, serp_api_key):
     
     col1, col2, col3 = st.columns(3)
     with col1:
-        genre = st.selectbox("Genre", ["Action", "Comedy", "Drama", "Sci-Fi", "Horror", "Romance", "Thriller"])
+        genre = st.selectbox("Genre", GENRE_OPTIONS)
     with col2:
-        target_audience = st.selectbox("Audience", ["General", "Teenagers", "Adults", "Family"])
+        target_audience = st.selectbox("Audience", AUDIENCE_OPTIONS)
     with col3:
         runtime = st.slider("Runtime (min)", 60, 180, 120)
     
     concept_title = st.text_input("Concept Title", "My Movie Concept")
+    bypass_cache = st.checkbox("🎲 Bypass cache (generate a fresh variation)",
+                               help="Identical requests are normally answered from previously generated results.")
+    check_similar = st.checkbox("🔎 Check my saved concepts for a similar idea first", value=True)
     
     if st.button("🚀 Generate Complete Concept", use_container_width=True):
         if not movie_idea:
             st.error("Please enter a movie idea")
             return
             
-        with st.spinner("Creating your movie concept... This may take 2-3 minutes"):
-            # Generate script
-            script_prompt = f"""Create a detailed script outline for a {industry} {genre} movie:
+        params = {
+            'industry': industry,
+            'genre': genre,
+            'target_audience': target_audience,
+            'runtime': runtime,
+            'movie_idea': movie_idea,
+            'concept_title': concept_title,
+            'use_cache': not bypass_cache
+        }
+        matches = find_similar_to_idea(st.session_state.user_id, movie_idea) if check_similar else []
+        if matches:
+            st.session_state.pending_generation = {'params': params, 'matches': matches}
+        else:
+            st.session_state.pending_generation = None
+            st.session_state.active_job_id = submit_generation_job(st.session_state.user_id, params)
 
-Title: {concept_title}
-Industry: {industry}
-Genre: {genre}
-Audience: {target_audience}
-Runtime: {runtime} minutes
-Idea: {movie_idea}
+    if st.session_state.get('pending_generation'):
+        show_similar_idea_prompt(st.session_state.pending_generation)
 
-Include: 3-act structure, character descriptions, key plot points, and twists."""
-            
-            script_output = call_gemini_api(gemini_api_key, script_prompt)
-            if not script_output:
+    with st.expander("🧪 Batch variants"):
+        st.caption("Generate every combination of the selected genres, audiences and runtimes "
+                   "from the idea above. Variants are saved to My Saved Concepts.")
+        batch_genres = st.multiselect("Genres", GENRE_OPTIONS, default=[genre])
+        batch_audiences = st.multiselect("Audiences", AUDIENCE_OPTIONS, default=[target_audience])
+        batch_runtimes = st.multiselect("Runtimes (min)", sorted(set(BATCH_RUNTIME_OPTIONS) | {runtime}),
+                                        default=[runtime])
+        variant_count = len(batch_genres) * len(batch_audiences) * len(batch_runtimes)
+        if st.button(f"🚀 Generate {variant_count} variants", use_container_width=True,
+                     disabled=variant_count == 0):
+            if not movie_idea:
+                st.error("Please enter a movie idea")
                 return
-                
-            # Generate casting
-            casting_prompt = f"""Suggest casting for this {industry} movie:
-
-{script_output}
-
-For each main character, suggest 2-3 {industry} actors with reasons. Consider availability and suitability."""
-            
-            casting_output = call_gemini_api(gemini_api_key, casting_prompt)
-            if not casting_output:
+            if variant_count > BATCH_MAX_VARIANTS:
+                st.error(f"Please select at most {BATCH_MAX_VARIANTS} combinations")
                 return
-                
-            # Generate production notes
-            production_prompt = f"""Create production notes for this {industry} movie:
+            base = {'industry': industry, 'movie_idea': movie_idea, 'concept_title': concept_title}
+            st.session_state.active_job_id = submit_generation_job(st.session_state.user_id, {
+                'variants': expand_concept_variants(base, batch_genres, batch_audiences, batch_runtimes),
+                'use_cache': not bypass_cache
+            })
 
-Script: {script_output[:1000]}
-Casting: {casting_output[:1000]}
+    # Pick up a job still running from an earlier visit (e.g. after a page reload)
+    if st.session_state.get('active_job_id') is None:
+        job = get_active_generation_job(st.session_state.user_id)
+        if job:
+            st.session_state.active_job_id = job['id']
 
-Include: budget estimate, filming locations, director suggestions, marketing strategy."""
-            
-            production_output = call_gemini_api(gemini_api_key, production_prompt)
-            if not production_output:
-                return
-                
-            # Save concept
-            concept_data = {
-                'script': script_output,
-                'casting': casting_output,
-                'production': production_output,
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            st.session_state.concept_data = concept_data
-            save_movie_concept(st.session_state.user_id, concept_title, industry, concept_data)
-            st.success("Concept generated successfully!")
+    if st.session_state.get('active_job_id'):
+        show_generation_job(st.session_state.active_job_id)
+    finished_job_id = st.session_state.pop('finished_job_id', None)
+    if finished_job_id:
+        show_job_outcome(finished_job_id)
     
-    # Display results
-    if st.session_state.concept_data:
-        data = st.session_state.concept_data
-        
-        st.markdown("---")
-        st.subheader("📜 Script Outline")
-        st.write(data['script'])
-        
-        st.subheader("🎭 Casting Suggestions")
-        st.write(data['casting'])
-        
-        # Real actor research
-        if serp_api_key:
-            st.subheader("🔍 Actor Research")
-            actors = extract_actor_names(data['casting'])
-            if actors:
-                for actor in actors:
-                    with st.expander(f"🎬 {actor}"):
-                        actor_info = search_actor_info(actor, serp_api_key, industry)
-                        if 'error' in actor_info:
-                            st.error(actor_info['error'])
-                        else:
-                            if actor_info['latest_projects']:
-                                st.write("**Latest Projects:**")
-                                for project in actor_info['latest_projects'][:3]:
-                                    st.write(f"- {project['title']}")
-                                    if project['description']:
-                                        st.caption(project['description'])
-                            if actor_info['news']:
-                                st.write("**Recent News:**")
-                                for news in actor_info['news'][:2]:
-                                    st.write(f"- {news['title']}")
-                                    st.caption(f"{news['source']} - {news.get('date', 'Recent')}")
-        
-        st.subheader("💼 Production Notes")
-        st.write(data['production'])
-        
-        # Download
-        concept_text = f"""MOVIE CONCEPT: {concept_title}
-Industry: {industry}
-Generated: {data['timestamp']}
+@st.fragment
+@instrumented('cineai_fragment', fragment='results')
+def show_concept_results(serp_api_key):
+    notice = st.session_state.pop('generation_notice', None)
+    if notice:
+        st.success(notice)
+    if not st.session_state.concept_data:
+        return
 
-SCRIPT:
-{data['script']}
+    data = st.session_state.concept_data
+    info = st.session_state.get('concept_info') or {'title': "My Movie Concept", 'industry': "Hollywood"}
+    concept_title, industry = info['title'], info['industry']
+    
+    st.markdown("---")
+    st.subheader(SECTION_HEADINGS['script'])
+    st.write(data['script'])
+    
+    st.subheader(SECTION_HEADINGS['casting'])
+    st.write(data['casting'])
+    
+    # Real actor research
+    if serp_api_key:
+        actors = concept_actor_names(data)
+        if actors:
+            show_actor_research(actors, serp_api_key, industry)
+    
+    st.subheader(SECTION_HEADINGS['production'])
+    st.write(data['production'])
+    
+    # Download
+    concept_text = session_memo(
+        'concept_text', (concept_fingerprint(data), concept_title, industry),
+        lambda: build_concept_text(concept_title, industry, data)
+    )
+    
+    st.download_button("📥 Download Concept", concept_text, 
+                      file_name=f"{concept_title.replace(' ', '_')}.txt")
 
-CASTING:
-{data['casting']}
+    if info.get('concept_id') is not None:
+        show_regenerate_actions(info['concept_id'], concept_title, industry, data)
 
-PRODUCTION:
-{data['production']}"""
-        
-        st.download_button("📥 Download Concept", concept_text, 
-                          file_name=f"{concept_title.replace(' ', '_')}.txt")
+def show_regenerate_actions(concept_id, concept_title: str, industry: str, data: Dict):
+    st.caption("Not happy with a section? Regenerating it keeps the rest and only redoes the sections "
+               "that depend on it. The result is saved as a new version.")
+    busy = bool(st.session_state.get('active_job_id'))
+    for column, section in zip(st.columns(len(ConceptPipeline.STAGES)), ConceptPipeline.STAGES):
+        with column:
+            # Concepts saved before briefs were kept can't rebuild their script prompt
+            unavailable = section == 'script' and not data.get('brief')
+            if st.button(f"🔄 Regenerate {section}", key=f"regenerate_{section}", use_container_width=True,
+                         disabled=busy or unavailable):
+                st.session_state.active_job_id = submit_generation_job(st.session_state.user_id, {
+                    'regenerate': [section],
+                    'concept_id': concept_id,
+                    'concept_title': concept_title,
+                    'industry': industry
+                })
+                # Job progress is shown by the creator fragment
+                st.rerun()
+
+@st.fragment
+@instrumented('cineai_fragment', fragment='actor_research')
+def show_actor_research(actors: List[str], serp_api_key: str, industry: str):
+    # Research is lazy: only actors whose toggle is on cost a SerpAPI call
+    st.subheader("🔍 Actor Research")
+    placeholders = {}
+    for actor in actors:
+        if st.toggle(f"🎬 {actor}", key=f"research_{industry}_{actor}"):
+            placeholders[actor] = st.empty()
+            placeholders[actor].caption("🔄 Researching...")
+
+    def show_queue_position(actor: str, position: Optional[int]):
+        placeholders[actor].caption("🔄 Researching..." if position is None
+                                    else f"⏳ Queued for SerpAPI, position {position}...")
 
+    for actor, actor_info in search_actors_info(list(placeholders), serp_api_key, industry,
+                                                on_queue=show_queue_position):
+        with placeholders[actor].container():
+            render_actor_info(actor_info)
 # Run the app
 if __name__ == "__main__":
-    if st.session_state.user_id is None:
-        login_page()
-    else:
-        main_app()
\ No newline at end of file
+    # Every app process runs a dispatcher, so jobs queued (or orphaned by a
+    # dead process) before a restart are picked up without a new submission
+    get_job_manager()
+    _rerun_spans.spans = []
+    try:
+        with timed('cineai_rerun', page=st.session_state.page if st.session_state.user_id else 'login'):
+            if st.session_state.user_id is None:
+                login_page()
+            else:
+                main_app()
+        if st.session_state.username in ADMIN_USERS:
+            show_timing_panel(_rerun_spans.spans)
+    finally:
+        _rerun_spans.spans = None
\ No newline at end of file
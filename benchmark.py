@@ -0,0 +1,431 @@
+"""Offline benchmark for CineAI.
+
+Runs the Gemini, SerpAPI, generation pipeline and SQLite code paths of app.py
+against local fake upstream servers and a throwaway database, and reports
+p50/p95/p99 latency, throughput and memory per scenario.
+
+    python benchmark.py                          # all scenarios
+    python benchmark.py pipeline actors -c 16 -n 400 --latency 0.2
+    python benchmark.py --json current.json --baseline baseline.json
+
+With --baseline the run exits non-zero if any scenario's p95 latency or
+throughput regressed by more than --max-regression.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCENARIOS = ('gemini', 'gemini_stream', 'actors', 'trends', 'pipeline',
+             'db_write', 'db_details', 'db_page', 'db_search')
+
+# Fake upstreams. One server answers both Gemini (generateContent and
+# streamGenerateContent?alt=sse) and SerpAPI (/search), with configurable
+# latency, error rate and response size.
+FAKE_ACTORS = ["Tom Hanks", "Meryl Streep", "Denzel Washington", "Viola Davis",
+               "Shah Rukh Khan", "Deepika Padukone", "Cate Blanchett", "Idris Elba"]
+FILLER = ("The story moves between rain-soaked rooftops and crowded night markets "
+          "while the stakes rise for everyone involved. ")
+
+class FakeUpstreamConfig:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0,
+                 error_status: int = 503, response_chars: int = 4000, stream_chunks: int = 20,
+                 chunk_interval: float = 0.005):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.response_chars = response_chars
+        self.stream_chunks = stream_chunks
+        self.chunk_interval = chunk_interval
+
+def fake_gemini_text(prompt: str, size: int) -> str:
+    actors = random.sample(FAKE_ACTORS, 3)
+    header = (
+        "## Title\nBenchmark Story\n\n"
+        "## Main Characters\n"
+        f"- **Detective Rao**: a tired cop. Option: {actors[0]}\n"
+        f"- **Mira**: a young hacker. Option: {actors[1]}\n"
+        f"- **The Broker**: the villain. Option: {actors[2]}\n\n"
+        "## Plot Summary\n"
+    )
+    body = (FILLER * (max(0, size - len(header)) // len(FILLER) + 1))[:max(0, size - len(header))]
+    return header + body
+
+def fake_gemini_json(schema: Dict, size: int) -> str:
+    """A response to a structured (responseSchema) request of roughly ``size`` characters."""
+    reason = FILLER.strip()
+    if 'characters' in schema.get('properties', {}):
+        count = max(1, size // (4 * len(reason)))
+        data = {'characters': [
+            {'name': f"Character {i}", 'description': "A key role.",
+             'candidates': [{'actor': actor, 'reason': reason} for actor in random.sample(FAKE_ACTORS, 3)]}
+            for i in range(count)
+        ]}
+    else:
+        count = max(1, size // (2 * len(reason)))
+        data = {'budget': {'min_usd_millions': 20, 'max_usd_millions': 35, 'notes': reason},
+                'locations': [{'name': f"Location {i}", 'reason': reason} for i in range(count)],
+                'directors': [{'name': "Jane Director", 'reason': reason}],
+                'marketing_strategy': reason}
+    return json.dumps(data)
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def config(self) -> FakeUpstreamConfig:
+        return self.server.config
+
+    def _delay(self):
+        time.sleep(max(0.0, self.config.latency + random.uniform(-self.config.jitter, self.config.jitter)))
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _maybe_fail(self) -> bool:
+        if random.random() < self.config.error_rate:
+            self._send(self.config.error_status, b'{"error": {"message": "injected failure"}}')
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        self._delay()
+        if self._maybe_fail():
+            return
+        prompt = payload.get('contents', [{}])[0].get('parts', [{}])[0].get('text', '')
+        schema = payload.get('generationConfig', {}).get('responseSchema')
+        if schema:
+            text = fake_gemini_json(schema, self.config.response_chars)
+        else:
+            text = fake_gemini_text(prompt, self.config.response_chars)
+        usage = {'promptTokenCount': len(prompt) // 4, 'candidatesTokenCount': len(text) // 4}
+        usage['totalTokenCount'] = usage['promptTokenCount'] + usage['candidatesTokenCount']
+        path = urlparse(self.path).path
+
+        if path.endswith(':generateContent'):
+            body = {'candidates': [{'content': {'parts': [{'text': text}]}}], 'usageMetadata': usage}
+            self._send(200, json.dumps(body).encode('utf-8'))
+        elif path.endswith(':streamGenerateContent'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            step = max(1, len(text) // max(1, self.config.stream_chunks))
+            for start in range(0, len(text), step):
+                chunk = {'candidates': [{'content': {'parts': [{'text': text[start:start + step]}]}}]}
+                if start + step >= len(text):
+                    chunk['usageMetadata'] = usage
+                self.wfile.write(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\r\n\r\n')
+                self.wfile.flush()
+                time.sleep(self.config.chunk_interval)
+            self.close_connection = True
+        else:
+            self._send(404, b'{}')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/search':
+            self._send(404, b'{}')
+            return
+        self._delay()
+        if self._maybe_fail():
+            return
+        query = parse_qs(url.query).get('q', [''])[0]
+        snippet = (FILLER * (self.config.response_chars // 10 // len(FILLER) + 1))[:self.config.response_chars // 10]
+        body = {
+            'organic_results': [
+                {'title': f"{query[:30]} new movie project {i}", 'snippet': snippet,
+                 'link': f"https://example.com/{i}"}
+                for i in range(8)
+            ],
+            'news_results': [
+                {'title': f"Industry news {i}", 'snippet': snippet, 'source': 'Example Times',
+                 'date': '1 day ago', 'link': f"https://example.com/news/{i}"}
+                for i in range(5)
+            ]
+        }
+        self._send(200, json.dumps(body).encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_upstream(config: FakeUpstreamConfig) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeUpstreamHandler)
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name="fake-upstream", daemon=True).start()
+    return server
+
+# Measurement
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(1, rank)) - 1]
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_scenario(op: Callable[[int], bool], requests: int, concurrency: int,
+                 trace_memory: bool = False) -> Dict:
+    """Call ``op(i)`` ``requests`` times from ``concurrency`` threads. ``op``
+    returns False (or raises) to count the call as an error."""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def timed_op(i: int):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = op(i)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    if trace_memory:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed_op, range(requests)))
+    wall = time.perf_counter() - wall_start
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput': requests / wall if wall else 0.0,
+        'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'traced_peak_mb': traced_peak
+    }
+
+# Scenarios. Each builder does its setup and returns the per-request op.
+# Concept reads go to the uncached loaders so the database is what's measured.
+IDEA = "A burned-out detective teams up with a teenage hacker to stop a data heist"
+
+def build_scenarios(app, args) -> Dict[str, Callable[[], Callable[[int], bool]]]:
+    def api_key(i: int) -> str:
+        return f"bench-key-{i % args.keys}"
+
+    def gemini():
+        return lambda i: app.call_gemini_api(api_key(i), f"{IDEA} #{i}", use_cache=False) is not None
+
+    def gemini_stream():
+        def op(i: int) -> bool:
+            return bool(''.join(app.stream_gemini_api(api_key(i), f"{IDEA} #{i}", use_cache=False)))
+        return op
+
+    def actors():
+        # Names come from a pool of --actor-pool, so the pool size sets the cache hit ratio
+        run = f"{time.time_ns()}"
+        return lambda i: 'error' not in app.search_actor_info(
+            f"Bench Actor {run} {random.randrange(args.actor_pool)}", api_key(i), 'Hollywood'
+        )
+
+    def trends():
+        return lambda i: 'error' not in app.get_industry_trends(api_key(i), random.choice(['Hollywood', 'Bollywood']))
+
+    def pipeline():
+        def op(i: int) -> bool:
+            concept = app.ConceptPipeline(api_key(i), 'Hollywood', 'Thriller', 'Adults (18+)', 120, IDEA,
+                                          f"Bench #{i}", use_cache=False).run()
+            names = app.concept_actor_names(concept)
+            results = list(app.search_actors_info(names, api_key(i), 'Hollywood'))
+            return all('error' not in info for _, info in results)
+        return op
+
+    def seeded_user() -> int:
+        username = f"bench-{time.time_ns()}"
+        app.create_user(username, 'benchmark')
+        user_id = app.authenticate_user(username, 'benchmark')
+        for i in range(args.seed_concepts):
+            app.save_movie_concept(user_id, f"Seed concept {i}", 'Hollywood', sample_concept(i))
+        return user_id
+
+    def sample_concept(i: int) -> Dict:
+        text = fake_gemini_text(IDEA, args.response_chars)
+        return {'script': text, 'casting': text, 'production': text,
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'seq': i}
+
+    def db_write():
+        user_id = seeded_user()
+        return lambda i: app.save_movie_concept(user_id, f"Bench concept {i}", 'Hollywood',
+                                                sample_concept(i)) is not None
+
+    def db_details():
+        user_id = seeded_user()
+        with app.db_connection() as conn:
+            ids = [row[0] for row in conn.execute("SELECT id FROM movie_concepts WHERE user_id = ?", (user_id,))]
+        return lambda i: bool(app._load_concept_details(random.choice(ids)))
+
+    def db_page():
+        user_id = seeded_user()
+
+        def op(i: int) -> bool:
+            # Walk a few pages deep from the newest concept
+            cursor = None
+            for _ in range(1 + i % 5):
+                rows, cursor = app._load_user_concepts_page(user_id, 20, cursor)
+                if cursor is None:
+                    break
+            return bool(rows)
+        return op
+
+    def db_search():
+        user_id = seeded_user()
+        words = ['detective', 'hacker', 'rooftops', 'night market', 'broker', 'seed']
+        return lambda i: app._search_user_concepts(
+            user_id, app.build_search_query(random.choice(words)), 20, 0
+        ) is not None
+
+    return {
+        'gemini': gemini, 'gemini_stream': gemini_stream, 'actors': actors, 'trends': trends,
+        'pipeline': pipeline, 'db_write': db_write, 'db_details': db_details, 'db_page': db_page,
+        'db_search': db_search
+    }
+
+# Reporting and regression gating
+def print_report(results: Dict[str, Dict]):
+    header = f"{'scenario':<14}{'req':>6}{'conc':>6}{'err':>6}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        rss = f"{r['peak_rss_mb']:.0f}" if r['peak_rss_mb'] is not None else '-'
+        print(f"{name:<14}{r['requests']:>6}{r['concurrency']:>6}{r['errors']:>6}{r['throughput']:>10.1f}"
+              f"{r['p50'] * 1000:>10.1f}{r['p95'] * 1000:>10.1f}{r['p99'] * 1000:>10.1f}{rss:>9}")
+
+def find_regressions(results: Dict[str, Dict], baseline: Dict[str, Dict], max_regression: float) -> List[str]:
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base['p95'] and current['p95'] > base['p95'] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {base['p95'] * 1000:.1f} ms -> {current['p95'] * 1000:.1f} ms")
+        if base['throughput'] and current['throughput'] < base['throughput'] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {base['throughput']:.1f} -> {current['throughput']:.1f} ops/s")
+        if current['errors'] > base['errors'] and current['errors'] > current['requests'] * max_regression:
+            regressions.append(f"{name}: errors {base['errors']} -> {current['errors']}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline CineAI benchmark")
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help=f"scenarios to run (default: all): {', '.join(SCENARIOS)}")
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-n', '--requests', type=int, default=100, help="requests per scenario")
+    parser.add_argument('--latency', type=float, default=0.05, help="fake upstream latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of upstream calls that fail")
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--response-chars', type=int, default=4000, help="size of generated Gemini text")
+    parser.add_argument('--stream-chunks', type=int, default=20)
+    parser.add_argument('--chunk-interval', type=float, default=0.005)
+    parser.add_argument('--keys', type=int, default=4, help="distinct API keys requests are spread over")
+    parser.add_argument('--actor-pool', type=int, default=50, help="distinct actor names in the actors scenario")
+    parser.add_argument('--seed-concepts', type=int, default=200, help="concepts seeded for DB scenarios")
+    parser.add_argument('--db', help="database path (default: a temporary file)")
+    parser.add_argument('--respect-rate-limits', action='store_true',
+                        help="keep app.py's upstream rate limits instead of lifting them")
+    parser.add_argument('--trace-memory', action='store_true', help="report tracemalloc peak (slows things down)")
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    return args
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    server = start_fake_upstream(FakeUpstreamConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status,
+        response_chars=args.response_chars, stream_chunks=args.stream_chunks,
+        chunk_interval=args.chunk_interval
+    ))
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # app.py reads its configuration at import time
+    os.environ['CINEAI_GEMINI_MODEL_URL'] = f"{base_url}/v1beta/models/fake-gemini"
+    os.environ['CINEAI_SERPAPI_URL'] = f"{base_url}/search"
+    os.environ['CINEAI_DB_PATH'] = args.db or os.path.join(tempfile.mkdtemp(prefix='cineai-bench-'), 'bench.db')
+    if not args.respect_rate_limits:
+        for upstream in ('GEMINI', 'SERPAPI'):
+            for setting in ('GLOBAL_RATE', 'GLOBAL_BURST', 'KEY_RATE', 'KEY_BURST'):
+                os.environ.setdefault(f"CINEAI_{upstream}_{setting}", '100000')
+    os.environ.setdefault('CINEAI_HTTP_POOL_MAXSIZE', str(max(16, args.concurrency * 4)))
+    os.environ.setdefault('CINEAI_DB_POOL_SIZE', str(max(8, args.concurrency)))
+
+    # Outside `streamlit run` every st.* call warns about the missing script context
+    logging.disable(logging.WARNING)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    builders = build_scenarios(app, args)
+    results = {}
+    for name in args.scenarios or SCENARIOS:
+        op = builders[name]()
+        results[name] = run_scenario(op, args.requests, args.concurrency, args.trace_memory)
+    server.shutdown()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = find_regressions(results, baseline, args.max_regression)
+        if regressions:
+            print("\nPerformance regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""Headless CineAI entry point.
+
+Generates, backs up and restores concepts without the Streamlit UI, using
+the same pipeline, caches and database as app.py:
+
+    python cli.py generate --username alice --idea "A heist on a Mars colony" --genre Sci-Fi
+    python cli.py batch --username alice --idea "A heist on a Mars colony" \\
+        --genres Action Sci-Fi Thriller --audiences Adults Teenagers --runtimes 100 120 \\
+        --output variants.jsonl
+    python cli.py regenerate 42 --sections casting            # saves a new version of concept 42
+    python cli.py export --output backup.jsonl.gz            # every user's concepts
+    python cli.py import backup.jsonl.gz                      # back to the same usernames
+
+The Gemini key comes from --gemini-key, the GEMINI_API_KEY environment
+variable or the user's saved settings, in that order.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+# Outside `streamlit run` every st.* call warns about the missing script context
+logging.disable(logging.WARNING)
+import app
+
+def resolve_user(username: str):
+    with app.db_connection() as conn:
+        row = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+    if row is None:
+        raise SystemExit(f"error: unknown user {username!r}")
+    return row[0]
+
+def resolve_gemini_key(args, user_id) -> str:
+    api_key = args.gemini_key or os.environ.get("GEMINI_API_KEY")
+    if not api_key and user_id is not None:
+        api_key = app.get_user_api_keys(user_id)[0]
+    if not api_key:
+        raise SystemExit("error: no Gemini API key (use --gemini-key, GEMINI_API_KEY or save one in the app)")
+    return api_key
+
+def write_results(results, args):
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for result in results:
+            out.write(json.dumps(result) + '\n')
+    finally:
+        if args.output:
+            out.close()
+
+def report_progress(runner):
+    print(f"\r{runner.progress_label():<78}", end='', file=sys.stderr, flush=True)
+
+def cmd_generate(args) -> int:
+    user_id = resolve_user(args.username) if args.username else None
+    api_key = resolve_gemini_key(args, user_id)
+    pipeline = app.ConceptPipeline(api_key, args.industry, args.genre, args.audience, args.runtime,
+                                   args.idea, args.title, use_cache=not args.no_cache)
+    try:
+        concept_data = pipeline.run(on_progress=report_progress, poll_interval=1.0)
+    except app.GenerationError as e:
+        print(f"\nerror: {e}", file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+
+    result = {'title': args.title, 'industry': args.industry, 'concept_data': concept_data}
+    if user_id is not None and not args.no_save:
+        result['concept_id'] = app.save_movie_concept(user_id, args.title, args.industry, concept_data)
+    write_results([result], args)
+    return 0
+
+def cmd_batch(args) -> int:
+    user_id = resolve_user(args.username) if args.username else None
+    api_key = resolve_gemini_key(args, user_id)
+    base = {'industry': args.industry, 'movie_idea': args.idea, 'concept_title': args.title}
+    variants = app.expand_concept_variants(base, args.genres, args.audiences, args.runtimes)
+
+    start = time.monotonic()
+    try:
+        batch = app.ConceptBatch(api_key, variants, max_workers=args.workers, use_cache=not args.no_cache)
+        results = batch.run(on_progress=report_progress, poll_interval=1.0)
+    except app.GenerationError as e:
+        print(f"\nerror: {e}", file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+
+    if user_id is not None and not args.no_save:
+        concept_ids = iter(app.save_batch_results(user_id, results))
+        for result in results:
+            if 'concept_data' in result:
+                result['concept_id'] = next(concept_ids)
+    write_results(results, args)
+
+    failed = sum(1 for result in results if 'error' in result)
+    print(f"{len(results) - failed}/{len(results)} variants generated in {time.monotonic() - start:.0f}s",
+          file=sys.stderr)
+    return 1 if failed == len(results) else 0
+
+def cmd_regenerate(args) -> int:
+    user_id = app.get_concept_owner(args.concept_id)
+    if user_id is None:
+        raise SystemExit(f"error: unknown concept {args.concept_id}")
+    api_key = resolve_gemini_key(args, user_id)
+    with app.db_connection() as conn:
+        title, industry = conn.execute("SELECT title, industry FROM movie_concepts WHERE id = ?",
+                                       (args.concept_id,)).fetchone()
+    try:
+        pipeline = app.ConceptPipeline.for_regeneration(api_key, app.get_concept_details(args.concept_id), industry,
+                                                        args.sections, use_cache=not args.no_cache)
+        concept_data = pipeline.run(on_progress=report_progress, poll_interval=1.0)
+    except app.GenerationError as e:
+        print(f"\nerror: {e}", file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+
+    result = {'title': title, 'industry': industry, 'concept_data': concept_data, 'reused': sorted(pipeline.reused)}
+    if args.no_save:
+        with app.db_connection() as conn:
+            concept_data['version'] = app.next_concept_version(conn, args.concept_id)
+        result['title'] = app.versioned_title(title, concept_data['version'])
+    else:
+        result['concept_id'], result['title'] = app.save_concept_version(user_id, title, industry, concept_data,
+                                                                         args.concept_id)
+    write_results([result], args)
+    return 0
+
+def cmd_export(args) -> int:
+    user_id = resolve_user(args.username) if args.username else None
+    if args.output:
+        with app.open_concept_archive(args.output, 'wb') as out:
+            count = app.export_concepts(out, user_id)
+    else:
+        count = app.export_concepts(sys.stdout.buffer, user_id)
+    print(f"Exported {count} concepts", file=sys.stderr)
+    return 0
+
+def cmd_import(args) -> int:
+    user_id = resolve_user(args.username) if args.username else None
+    if args.path == '-':
+        counts = app.import_concepts(sys.stdin.buffer, user_id, batch_size=args.batch_size)
+    else:
+        with app.open_concept_archive(args.path, 'rb') as archive:
+            counts = app.import_concepts(archive, user_id, batch_size=args.batch_size)
+    print(f"Imported {counts['imported']} concepts, skipped {counts['skipped']} "
+          f"(existing or unknown user), {counts['invalid']} invalid lines", file=sys.stderr)
+    return 1 if counts['invalid'] and not counts['imported'] else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate, back up and restore CineAI movie concepts without the UI")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--username', help="save results for this user (and use their saved API key)")
+    common.add_argument('--gemini-key', help="Gemini API key")
+    common.add_argument('--industry', choices=["Hollywood", "Bollywood"], default="Hollywood")
+    common.add_argument('--idea', required=True, help="the movie idea")
+    common.add_argument('--title', default="My Movie Concept")
+    common.add_argument('--no-cache', action='store_true', help="bypass the generation cache")
+    common.add_argument('--no-save', action='store_true', help="don't save results to the database")
+    common.add_argument('--output', help="write JSON lines here instead of stdout")
+
+    generate = subparsers.add_parser('generate', parents=[common], help="generate one concept")
+    generate.add_argument('--genre', choices=app.GENRE_OPTIONS, default="Drama")
+    generate.add_argument('--audience', choices=app.AUDIENCE_OPTIONS, default="General")
+    generate.add_argument('--runtime', type=int, default=120)
+    generate.set_defaults(func=cmd_generate)
+
+    batch = subparsers.add_parser('batch', parents=[common],
+                                  help="generate every genre x audience x runtime variant of an idea")
+    batch.add_argument('--genres', nargs='+', choices=app.GENRE_OPTIONS, required=True)
+    batch.add_argument('--audiences', nargs='+', choices=app.AUDIENCE_OPTIONS, default=["General"])
+    batch.add_argument('--runtimes', nargs='+', type=int, default=[120])
+    batch.add_argument('--workers', type=int, default=app.BATCH_MAX_WORKERS,
+                       help="variants generated concurrently")
+    batch.set_defaults(func=cmd_batch)
+
+    regenerate = subparsers.add_parser('regenerate', help="regenerate sections of a saved concept as a new version")
+    regenerate.add_argument('concept_id', type=int)
+    regenerate.add_argument('--sections', nargs='+', choices=app.ConceptPipeline.STAGES, required=True,
+                            help="sections to regenerate; sections depending on them are redone if their input changed")
+    regenerate.add_argument('--gemini-key', help="Gemini API key")
+    regenerate.add_argument('--no-cache', action='store_true', help="bypass the generation cache")
+    regenerate.add_argument('--no-save', action='store_true', help="don't save the new version")
+    regenerate.add_argument('--output', help="write JSON lines here instead of stdout")
+    regenerate.set_defaults(func=cmd_regenerate)
+
+    export = subparsers.add_parser('export', help="write saved concepts as JSON lines (gzipped for *.gz)")
+    export.add_argument('--username', help="only this user's concepts (default: everyone's)")
+    export.add_argument('--output', help="archive path (default: stdout)")
+    export.set_defaults(func=cmd_export)
+
+    import_ = subparsers.add_parser('import', help="import concepts from an export archive")
+    import_.add_argument('path', help="archive path, or - for stdin")
+    import_.add_argument('--username', help="import everything for this user (default: by original username)")
+    import_.add_argument('--batch-size', type=int, default=app.IMPORT_BATCH_SIZE,
+                         help="concepts written per transaction")
+    import_.set_defaults(func=cmd_import)
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())